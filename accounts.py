@@ -0,0 +1,116 @@
+from html.parser import HTMLParser
+
+from forms import account_url
+from transactions import parse_cents
+
+ACCOUNT_VIEW_PATH = "/accounts/view/"
+
+
+class AccountInfo(object):
+    """
+    An account listed on the accounts overview page.
+    """
+
+    __slots__ = ("account_id", "account_type", "name", "number", "balance")
+
+    def __init__(self, account_id: str, account_type: str, name: str, number: str = None, balance: int = None):
+        self.account_id = account_id
+        self.account_type = account_type  # "" or "credit-card", as taken by export_statement
+        self.name = name
+        self.number = number
+        self.balance = balance  # Balance in cents, when listed
+
+    @property
+    def url(self) -> str:
+        return account_url(self.account_id, self.account_type)
+
+    def __eq__(self, other):
+        if not isinstance(other, AccountInfo):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return (
+            f"AccountInfo(account_id={self.account_id}, account_type={self.account_type!r}, name={self.name!r}, "
+            f"number={self.number}, balance={self.balance})"
+        )
+
+
+class _AccountListParser(HTMLParser):
+    """
+    Collects the account links of the accounts overview page, with the name, number
+    and balance spans that follow each link up to the next one.
+    """
+
+    FIELDS = {"account-name": "name", "account-number": "number", "account-balance": "balance"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.accounts = []
+        self.seen = {}
+        self.current = None
+        self.field = None
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+
+        if tag == "a" and "account-link" in classes:
+            path = (attrs.get("href") or "").split("?")[0].rstrip("/")
+            if path.startswith(ACCOUNT_VIEW_PATH):
+                account_type, _, account_id = path[len(ACCOUNT_VIEW_PATH):].rpartition("/")
+                # An account may be linked more than once, keep it once
+                self.current = self.seen.get(path)
+                if self.current is None:
+                    self.current = self.seen[path] = {"account_id": account_id, "account_type": account_type}
+                    self.accounts.append(self.current)
+            return
+
+        if self.current is not None and tag == "span":
+            for name in classes:
+                if name in self.FIELDS:
+                    self.field = self.FIELDS[name]
+                    self.text = []
+                    break
+
+    def handle_endtag(self, tag):
+        if tag == "span" and self.field is not None:
+            self.current[self.field] = "".join(self.text).strip()
+            self.field = None
+
+    def handle_data(self, data):
+        if self.field is not None:
+            self.text.append(data)
+
+
+def parse_accounts(content) -> list:
+    """
+    Extracts the accounts listed on the accounts overview page.
+
+    Args:
+        content (bytes | str): The page content.
+
+    Returns:
+        list: An AccountInfo per listed account, in page order.
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+
+    parser = _AccountListParser()
+    parser.feed(content)
+    parser.close()
+
+    accounts = []
+    for account in parser.accounts:
+        balance = account.get("balance")
+        accounts.append(
+            AccountInfo(
+                account["account_id"],
+                account["account_type"],
+                account.get("name", ""),
+                account.get("number"),
+                parse_cents(balance) if balance else None,
+            )
+        )
+    return accounts
@@ -0,0 +1,604 @@
+import asyncio
+import datetime
+import io
+import logging
+import os
+import time
+
+try:
+    import aiohttp
+except ImportError:  # Optional dependency, only needed for the asyncio client
+    aiohttp = None
+
+from accounts import parse_accounts
+from export_flow import (
+    ExportFlow,
+    ExportResult,
+    NoStatementDataError,
+    SessionExpiredError,
+    account_export_requests,
+    account_form_state,
+    redirected_to_login,
+)
+from export_stream import NewlineNormaliser
+from forms import FORM_HEADERS, challenge_form, login_form, solve_challenge
+from form_state import FORM_FIELDS, FormStateCache, parse_form_state
+from instrumentation import Instrumentation
+from kiwibank_api import KiwibankApi
+from resilience import Reauthenticator, RequestAttempts, RetryPolicy
+
+
+class AsyncKiwibankApi(object):
+    """
+    An asyncio variant of KiwibankApi built on aiohttp, sharing its form building and
+    parsing, so a single event loop can drive many accounts and logins concurrently.
+    """
+
+    BASE_URL = KiwibankApi.BASE_URL
+
+    def __init__(
+        self,
+        form_state_ttl: float = 300,
+        instrumentation: Instrumentation = None,
+        connection_limit: int = 10,
+        keepalive_timeout: float = 30,
+        timeout: tuple = (10, 60),
+        retry_policy: RetryPolicy = None,
+        circuit_breaker=None,
+        export_cache=None,
+    ):
+        """
+        Args:
+            form_state_ttl (float): Seconds to reuse an account page's form state for
+                repeated exports, 0 to fetch the page before every export.
+            instrumentation (Instrumentation): Receives request, parsing and form
+                building timings; see instrumentation.py for exporters.
+            connection_limit (int): The maximum number of pooled connections.
+            keepalive_timeout (float): Seconds to keep idle connections open for reuse.
+            timeout (tuple): The connect and read timeouts of every request, in seconds.
+            retry_policy (RetryPolicy): How idempotent requests are retried after
+                connection errors and transient error statuses.
+            circuit_breaker (CircuitBreaker): Pauses requests after repeated failures,
+                by default shared by all clients talking to the same host.
+            export_cache (ExportCache): Serves repeated exports of past periods from
+                disk instead of the bank; see export_cache.py.
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncKiwibankApi requires the aiohttp package.")
+
+        self.BASE_URL = self.BASE_URL.rstrip("/")
+
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.logger = logging.getLogger()
+        self.last_response = None
+        self.last_content = None
+        self.form_state_cache = FormStateCache(form_state_ttl)
+        self.instrumentation = instrumentation or Instrumentation()
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker
+        self.reauthenticator = None
+        self.accounts = None
+        self.export_cache = export_cache
+
+    async def login(self, username: str, password: str):
+        """
+        Logs into the Kiwibank online banking system using provided credentials.
+
+        Args:
+            username (str): The user's login username.
+            password (str): The user's password.
+        """
+        self.logger.info("Attempting login...")
+
+        # Form state and accounts from a previous session are no longer valid
+        self.form_state_cache.invalidate()
+        self.accounts = None
+
+        try:
+            # Perform GET request to fetch the login page
+            await self._request("GET", f"{self.BASE_URL}/login/", "login_page")
+        except aiohttp.ClientError as e:
+            self.logger.error(f"Network error: {e}")
+            raise
+
+        try:
+            # Extract necessary form fields from the login page
+            with self.instrumentation.timer("parse", phase="login_page"):
+                form_state = parse_form_state(self.last_content, FORM_FIELDS)
+            # Prepare data payload for the login POST request
+            data = login_form(form_state, username, password)
+        except (TypeError, KeyError) as e:
+            self.logger.error(f"Failed to extract form fields: {e}")
+            raise ValueError("Unexpected login page structure.")
+
+        try:
+            # Send POST request to submit login details
+            await self._request("POST", f"{self.BASE_URL}/login/", "login", data=data)
+        except aiohttp.ClientError as e:
+            self.logger.error(f"Login request failed: {e}")
+            raise
+
+    async def resolve_challenge(self, questions: dict):
+        """
+        Resolves the additional security challenge.
+
+        Args:
+            questions (dict): A dictionary mapping security questions to their answers.
+        """
+        self.logger.info("Resolving security challenge...")
+
+        with self.instrumentation.timer("parse", phase="challenge_page"):
+            form_state = parse_form_state(self.last_content, FORM_FIELDS, challenge=True)
+
+        letter1, letter2, challenge_pattern = solve_challenge(form_state, questions)
+
+        self.logger.info(f"Challenge: {challenge_pattern}")
+        self.logger.debug(f"Letter 1: {letter1}")
+        self.logger.debug(f"Letter 2: {letter2}")
+
+        try:
+            # Extract form fields for submitting the challenge response
+            data = challenge_form(form_state, letter1, letter2)
+        except (TypeError, KeyError) as e:
+            self.logger.error(f"Failed to extract challenge form fields: {e}")
+            raise ValueError("Unexpected challenge page structure.")
+
+        try:
+            # Submit the challenge response
+            await self._request("POST", f"{self.BASE_URL}/keepsafe/challenge/", "challenge", data=data)
+        except aiohttp.ClientError as e:
+            self.logger.error(f"Failed to send challenge response: {e}")
+            raise
+
+    def enable_relogin(self, username: str, password: str, questions: dict):
+        """
+        Keeps the credentials needed to log in again automatically when the session
+        expires in the middle of exporting.
+
+        Args:
+            username (str): The user's login username.
+            password (str): The user's password.
+            questions (dict): A dictionary mapping security questions to their answers.
+        """
+        self.reauthenticator = Reauthenticator(username, password, questions)
+
+    async def list_accounts(self, refresh: bool = False) -> list:
+        """
+        Lists the accounts on the accounts overview page, which is only fetched once
+        per session unless refreshed.
+
+        Args:
+            refresh (bool): Whether to fetch the page again, for up to date balances.
+
+        Returns:
+            list: An AccountInfo per account.
+        """
+        if self.accounts is not None and not refresh:
+            return list(self.accounts)
+
+        self.logger.info("Listing accounts...")
+
+        try:
+            generation = self._auth_generation()
+            response, content = await self._request("GET", f"{self.BASE_URL}/accounts/", "accounts_page")
+            if _session_expired(response):
+                await self._reauthenticate(generation)
+                _, content = await self._request("GET", f"{self.BASE_URL}/accounts/", "accounts_page")
+        except aiohttp.ClientError as e:
+            self.logger.error(f"Failed to fetch accounts: {e}")
+            raise
+
+        with self.instrumentation.timer("parse", phase="accounts_page"):
+            accounts = parse_accounts(content)
+        if not accounts:
+            self.logger.error("No accounts found on the accounts page.")
+            raise ValueError("Unexpected accounts page structure.")
+
+        self.accounts = accounts
+        return list(accounts)
+
+    async def export_statement(
+        self,
+        account_id: str,
+        account_type: str,
+        date_from: datetime,
+        date_to: datetime,
+        amount_low: float,
+        amount_high: float,
+        export_include: str,
+        export_format: str,
+        stream: bool = False,
+        sink=None,
+        chunk_size: int = 65536,
+    ):
+        """
+        Exports a bank statement, as KiwibankApi.export_statement does.
+
+        Several exports may run concurrently on one client, as they share the
+        connection pool but not any per-request state.
+
+        Args:
+            account_id (str): The unique identifier for the account.
+            account_type (str): The type of the account.
+            date_from (datetime): The start date of the statement period.
+            date_to (datetime): The end date of the statement period.
+            amount_low (float): The lower bound of the transaction amount range.
+            amount_high (float): The upper bound of the transaction amount range.
+            export_include (str): The types of transaction details to include in the export.
+            export_format (str): The format of the export.
+            stream (bool): Whether to return an async iterator of chunks instead of the
+                whole statement. Text chunks are decoded with line endings normalised.
+            sink (str | os.PathLike | file): A path or open file to stream the statement
+                to instead of returning it.
+            chunk_size (int): The size in bytes of the chunks read when streaming.
+
+        Returns:
+            str: The content of the exported statement (bytes for PDF formats), an
+            async iterator of chunks if stream is set, or the number of bytes written
+            if a sink is given.
+        """
+        self.logger.info("Exporting statement...")
+
+        flow = ExportFlow(
+            self, account_id, account_type, date_from, date_to, amount_low, amount_high, export_include, export_format
+        )
+
+        if flow.cache_key is not None:
+            # The cache's index and blobs are read on worker threads, not the event loop
+            cached = await asyncio.to_thread(self.export_cache.open, flow.cache_key, chunk_size)
+            if flow.cached(cached):
+                if not stream and sink is None:
+                    return flow.result(await asyncio.to_thread(b"".join, cached))
+
+                chunks = _iter_cached(cached, not flow.binary)
+                if sink is None:
+                    return chunks
+                return await _write_to_sink(chunks, sink)
+
+        form_state = flow.initial_form_state()
+        if form_state is None:
+            form_state = await self._fetch_export_form_state(flow.account_url)
+
+        while True:
+            data = flow.form(form_state)
+
+            # Send POST request to perform the export
+            try:
+                response, _ = await self._request(
+                    "POST",
+                    self.BASE_URL + flow.account_url,
+                    "export",
+                    tags=flow.tags,
+                    data=data,
+                    headers=FORM_HEADERS,
+                    stream=True,
+                    # Exports only read statements, so they are safe to send again
+                    idempotent=True,
+                )
+            except aiohttp.ClientError as e:
+                self.logger.error(f"Failed to export statement: {e}")
+                raise
+
+            if "content-disposition" in response.headers:
+                break
+
+            if _session_expired(response):
+                response.release()
+                await self._reauthenticate(flow.relogin())
+                form_state = await self._fetch_export_form_state(flow.account_url)
+                continue
+
+            try:
+                content = await response.read()
+            finally:
+                response.release()
+            form_state = flow.rejected(content)
+            if form_state is None:
+                form_state = await self._fetch_export_form_state(flow.account_url)
+
+        if not stream and sink is None:
+            try:
+                content = await response.read()
+            finally:
+                response.release()
+            if flow.cache_key is not None:
+                await asyncio.to_thread(self.export_cache.put, flow.cache_key, content)
+            return flow.result(content)
+
+        chunks = self._iter_chunks(response, chunk_size, not flow.binary, flow.tags, flow.cache_key)
+        if sink is None:
+            return chunks
+
+        return await _write_to_sink(chunks, sink)
+
+    async def export_statements(self, export_requests: list, max_workers: int = 4):
+        """
+        Exports several statements concurrently on this client's event loop.
+
+        Args:
+            export_requests (list): The ExportRequest objects to export.
+            max_workers (int): The maximum number of exports in flight at once.
+
+        Returns:
+            list: An ExportResult per request, in the same order as the requests.
+        """
+        self.logger.info(f"Exporting {len(export_requests)} statements with {max_workers} workers...")
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def export(request):
+            async with semaphore:
+                try:
+                    return ExportResult(request, data=await self.export_statement(*request.args(), sink=request.sink))
+                except NoStatementDataError as e:
+                    self.logger.info(f"No statement data for {request}.")
+                    return ExportResult(request, error=e)
+                except Exception as e:
+                    self.logger.error(f"Export failed for {request}: {e}")
+                    return ExportResult(request, error=e)
+
+        return list(await asyncio.gather(*(export(request) for request in export_requests)))
+
+    async def export_all_statements(
+        self,
+        date_from: datetime,
+        date_to: datetime,
+        export_include: str = "DepositsAndWithdrawals",
+        export_format: str = "CSV-Extended",
+        account_types: tuple = None,
+        sink=None,
+        max_workers: int = 4,
+    ):
+        """
+        Exports the statements of every listed account (see list_accounts) concurrently.
+
+        Args:
+            date_from (datetime): The start date of the statement period.
+            date_to (datetime): The end date of the statement period.
+            export_include (str): The types of transaction details to include in the export.
+            export_format (str): The format of the exports.
+            account_types (tuple): Only export accounts of these types ("" or "credit-card").
+            sink (callable): Called with each AccountInfo to get the path or open file to
+                stream its statement to, instead of returning it.
+            max_workers (int): The maximum number of exports in flight at once.
+
+        Returns:
+            list: An ExportResult per account, whose request's account_id identifies it.
+        """
+        export_requests = account_export_requests(
+            await self.list_accounts(), date_from, date_to, export_include, export_format, account_types, sink
+        )
+        return await self.export_statements(export_requests, max_workers=max_workers)
+
+    async def logout(self):
+        """
+        Logs out of the Kiwibank session.
+        """
+        try:
+            await self._request("GET", f"{self.BASE_URL}/logout/", "logout")
+        except aiohttp.ClientError as e:
+            self.logger.error(f"Failed to log out: {e}")
+
+    async def close(self):
+        """
+        Closes the HTTP session and its pooled connections.
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _fetch_export_form_state(self, account_url: str):
+        """
+        Fetches an account page and caches the form state needed to export from it.
+        """
+        generation = self._auth_generation()
+        response, content = await self._request("GET", self.BASE_URL + account_url, "account_page", tags={"account": account_url})
+        if _session_expired(response):
+            await self._reauthenticate(generation)
+            _, content = await self._request("GET", self.BASE_URL + account_url, "account_page", tags={"account": account_url})
+
+        return account_form_state(self, account_url, content)
+
+    async def _get_session(self):
+        if self.session is None:
+            # The session must be created on the running event loop. An unsafe cookie
+            # jar also accepts cookies from IP addresses, such as a local mock server.
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=self.keepalive_timeout),
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                headers={"User-Agent": KiwibankApi.USER_AGENT},
+            )
+        return self.session
+
+    async def _request(
+        self, method: str, url: str, phase: str, tags: dict = None, stream: bool = False, idempotent: bool = None, **kwargs
+    ):
+        """
+        Sends an HTTP request, reporting its timings and size, and raises for error statuses.
+
+        Requests time out after the client's connect and read timeouts, and fail
+        fast while the host's circuit breaker is open. Idempotent requests are
+        retried with jittered exponential backoff after connection errors and
+        transient error statuses.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The absolute URL to request.
+            phase (str): The client step the request belongs to, used to tag measurements.
+            tags (dict): Extra tags for the measurements, such as the account.
+            stream (bool): Whether to leave the body unread, for the caller to consume.
+            idempotent (bool): Whether the request is safe to send again, by default
+                only for idempotent HTTP methods.
+            **kwargs: Passed on to aiohttp.ClientSession.request.
+
+        Returns:
+            tuple: The response and its body (None when streaming).
+        """
+        session = await self._get_session()
+
+        connect_timeout, read_timeout = self.timeout
+        kwargs.setdefault("timeout", aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout))
+        attempts = RequestAttempts(self, method, url, phase, tags, idempotent)
+
+        while True:
+            attempts.before_send()
+
+            start = time.perf_counter()
+            try:
+                response = await session.request(method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    raise
+            else:
+                delay = attempts.responded(response.status, response.headers)
+                if delay is None:
+                    break
+                response.release()
+
+            await asyncio.sleep(delay)
+
+        tags = dict(tags or {}, phase=phase, method=method, status=str(response.status))
+        ttfb = time.perf_counter() - start
+        self.instrumentation.timing("http.ttfb", ttfb, **tags)
+
+        content = None
+        try:
+            response.raise_for_status()
+            if not stream:
+                content = await response.read()
+                self.instrumentation.timing("http.download", time.perf_counter() - start - ttfb, **tags)
+                self.instrumentation.count("http.bytes", len(content), **tags)
+        finally:
+            if not stream or response.status >= 400:
+                response.release()
+
+        self.instrumentation.timing("http.request", time.perf_counter() - start, **tags)
+
+        self.last_response = response
+        if not stream:
+            self.last_content = content
+        return response, content
+
+    def _auth_generation(self) -> int:
+        return self.reauthenticator.generation if self.reauthenticator is not None else 0
+
+    async def _reauthenticate(self, generation: int):
+        """
+        Logs in again after the session expired, or raises SessionExpiredError if no
+        credentials are kept (see enable_relogin).
+
+        Args:
+            generation (int): The reauthenticator generation read before the failed request.
+        """
+        if self.reauthenticator is None:
+            self.logger.error("Session expired and relogin is not enabled.")
+            raise SessionExpiredError("The session has expired.")
+
+        self.logger.info("Session expired, logging in again...")
+        self.instrumentation.count("relogin")
+        await self.reauthenticator.reauthenticate_async(self, generation)
+
+    async def _iter_chunks(self, response, chunk_size: int, text: bool, tags: dict, cache_key: str = None):
+        """
+        Yields the body of a streamed response, decoded and normalised for text formats.
+        The raw body is added to the export cache under cache_key, if given, once complete;
+        it is compressed and written on worker threads.
+        """
+        cache_writer = None
+        if cache_key is not None:
+            cache_writer = await asyncio.to_thread(self.export_cache.writer, cache_key)
+        normaliser = NewlineNormaliser() if text else None
+        start = time.perf_counter()
+        size = 0
+
+        try:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                size += len(chunk)
+                if cache_writer is not None:
+                    await asyncio.to_thread(cache_writer.write, chunk)
+                if normaliser is None:
+                    yield chunk
+                    continue
+                chunk = normaliser.feed(chunk)
+                if chunk:
+                    yield chunk
+
+            if normaliser is not None:
+                chunk = normaliser.finish()
+                if chunk:
+                    yield chunk
+        except BaseException:
+            if cache_writer is not None:
+                await asyncio.to_thread(cache_writer.abort)
+            raise
+        else:
+            if cache_writer is not None:
+                await asyncio.to_thread(cache_writer.commit)
+        finally:
+            response.release()
+            self.instrumentation.timing("http.download", time.perf_counter() - start, phase="export", **tags)
+            self.instrumentation.count("http.bytes", size, phase="export", **tags)
+
+
+async def _iter_cached(chunks, text: bool):
+    """
+    Yields the chunks of a cached export, decoded and normalised for text formats.
+    The chunks are read and decompressed on a worker thread.
+    """
+    normaliser = NewlineNormaliser() if text else None
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            break
+        if normaliser is not None:
+            chunk = normaliser.feed(chunk)
+        if chunk:
+            yield chunk
+
+    if normaliser is not None:
+        chunk = normaliser.finish()
+        if chunk:
+            yield chunk
+
+
+async def _write_to_sink(chunks, sink) -> int:
+    """
+    Writes an async iterator of chunks to a path or open file, returning the size written.
+    The file is opened and written on worker threads.
+    """
+    if isinstance(sink, (str, os.PathLike)):
+        file = await asyncio.to_thread(open, sink, "wb")
+        try:
+            return await _write_to_sink(chunks, file)
+        finally:
+            await asyncio.to_thread(file.close)
+
+    text_mode = isinstance(sink, io.TextIOBase)
+    written = 0
+
+    async for chunk in chunks:
+        if text_mode and isinstance(chunk, bytes):
+            chunk = chunk.decode("utf-8")
+        elif not text_mode and isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+
+        await asyncio.to_thread(sink.write, chunk)
+        written += len(chunk)
+
+    return written
+
+
+def _session_expired(response) -> bool:
+    """
+    Returns whether a response was redirected to the login page.
+    """
+    return redirected_to_login(bool(response.history), response.url.path)
@@ -0,0 +1,149 @@
+"""
+Drives KiwibankApi end to end against the local mock server and reports
+throughput, latency percentiles and peak memory.
+
+Usage:
+    python benchmarks/bench_client.py [--accounts 20] [--workers 4] [--latency 0.02] [--days 90]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from instrumentation import Event  # noqa: E402
+from kiwibank_api import ExportRequest, KiwibankApi  # noqa: E402
+from mock_server import MockKiwibankServer  # noqa: E402
+
+QUESTIONS = {"The name of my first pet?": "pinette"}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def report(name, durations, wall_time, peak_memory):
+    count = len(durations)
+    print(
+        f"{name:<22}{count:>6}{count / wall_time:>10.1f}/s"
+        f"{percentile(durations, 0.5) * 1000:>10.1f}{percentile(durations, 0.9) * 1000:>10.1f}"
+        f"{percentile(durations, 0.99) * 1000:>10.1f}{peak_memory / 1024 / 1024:>10.1f}MB"
+    )
+
+
+def measure(run):
+    """
+    Runs a scenario twice, once for timings and once under tracemalloc (which slows
+    allocation down too much to time), and returns (durations, wall time, peak memory).
+    """
+    start = time.perf_counter()
+    durations = run()
+    wall_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    run()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return durations, wall_time, peak_memory
+
+
+def new_client(server):
+    api = KiwibankApi()
+    api.BASE_URL = server.url
+    return api
+
+
+def account_requests(count, days, export_format):
+    date_to = datetime.date(2024, 6, 30)
+    date_from = date_to - datetime.timedelta(days=days - 1)
+    return [
+        ExportRequest(f"{index:032X}", "", date_from, date_to, None, None, "DepositsAndWithdrawals", export_format)
+        for index in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=20, help="Accounts exported in the multi-account runs")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent exports in the batch run")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mock server latency per request, in seconds")
+    parser.add_argument("--rows-per-day", type=int, default=5, help="Transactions per day in exports")
+    parser.add_argument("--days", type=int, default=90, help="Days covered by each export")
+    parser.add_argument("--format", default="CSV-Extended", help="Export format")
+    parser.add_argument("--logins", type=int, default=5, help="Logins in the login run")
+    args = parser.parse_args()
+
+    with MockKiwibankServer(latency=args.latency, rows_per_day=args.rows_per_day) as server:
+        requests = account_requests(args.accounts, args.days, args.format)
+
+        def login():
+            durations = []
+            for _ in range(args.logins):
+                api = new_client(server)
+                start = time.perf_counter()
+                api.login("1234567", "password")
+                api.resolve_challenge(QUESTIONS)
+                durations.append(time.perf_counter() - start)
+            return durations
+
+        api = new_client(server)
+        api.login("1234567", "password")
+        api.resolve_challenge(QUESTIONS)
+
+        def single_account():
+            durations = []
+            for request in requests[:1] * args.accounts:
+                start = time.perf_counter()
+                api.export_statement(*request.args())
+                durations.append(time.perf_counter() - start)
+            return durations
+
+        def sequential():
+            durations = []
+            for request in requests:
+                start = time.perf_counter()
+                api.export_statement(*request.args())
+                durations.append(time.perf_counter() - start)
+            return durations
+
+        def batch():
+            # Per-export latency is the time spent in each account's requests and parsing
+            durations = {}
+
+            def collect(event):
+                if event.kind == Event.TIMING and event.name in ("http.request", "parse", "form_build"):
+                    account = event.tags.get("account")
+                    durations[account] = durations.get(account, 0.0) + event.value
+
+            api.instrumentation.add_hook(collect)
+            try:
+                results = api.export_statements(requests, max_workers=args.workers)
+            finally:
+                api.instrumentation.remove_hook(collect)
+
+            failed = [result for result in results if not result.ok]
+            if failed:
+                raise failed[0].error
+            return list(durations.values())
+
+        print(
+            f"mock latency {args.latency * 1000:.0f}ms, {args.days} days x {args.rows_per_day} rows per export, "
+            f"{args.format}"
+        )
+        print(f"{'scenario':<22}{'ops':>6}{'throughput':>12}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'peak mem':>12}")
+
+        report("login + challenge", *measure(login))
+        report("single account", *measure(single_account))
+        report("accounts sequential", *measure(sequential))
+        report(f"accounts batch x{args.workers}", *measure(batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares form_state.parse_form_state against the previous BeautifulSoup
+extraction on the saved fixture pages.
+
+Usage:
+    python benchmarks/bench_form_state.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from form_state import EXPORT_FORM_FIELDS, FORM_FIELDS, parse_form_state  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def soup_fields(content, field_ids):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, "html.parser")
+    return {field_id: soup.find(id=field_id)["value"] for field_id in field_ids}
+
+
+def soup_challenge(content):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, "html.parser")
+    question = soup.find(id="question").find_all("div")[1].string
+    required = ["required" in str(element) for element in soup.find(id="answer").find_all("div")[1:]]
+    fields = {field_id: soup.find(id=field_id)["value"] for field_id in FORM_FIELDS}
+    return question, required, fields
+
+
+CASES = [
+    ("login.html", lambda c: parse_form_state(c, FORM_FIELDS), lambda c: soup_fields(c, FORM_FIELDS)),
+    ("challenge.html", lambda c: parse_form_state(c, FORM_FIELDS, challenge=True), soup_challenge),
+    ("account.html", lambda c: parse_form_state(c, EXPORT_FORM_FIELDS), lambda c: soup_fields(c, EXPORT_FORM_FIELDS)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="Parses per measurement")
+    args = parser.parse_args()
+
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        bs4 = None
+        print("beautifulsoup4 is not installed, only timing form_state.")
+
+    print(f"{'page':<16}{'size':>10}{'form_state':>14}{'bs4':>14}{'speedup':>10}")
+
+    for name, fast, slow in CASES:
+        with open(os.path.join(FIXTURES, name), "rb") as fixture:
+            content = fixture.read()
+
+        fast_time = min(timeit.repeat(lambda: fast(content), number=args.repeat, repeat=3)) / args.repeat
+        line = f"{name:<16}{len(content):>10}{fast_time * 1000:>12.2f}ms"
+
+        if bs4 is not None:
+            state = fast(content)
+            expected = slow(content)
+            if name == "challenge.html":
+                assert (state.question, state.required, state.fields) == expected, "Extractors disagree"
+            else:
+                assert state.fields == expected, "Extractors disagree"
+
+            slow_time = min(timeit.repeat(lambda: slow(content), number=args.repeat, repeat=3)) / args.repeat
+            line += f"{slow_time * 1000:>12.2f}ms{slow_time / fast_time:>9.1f}x"
+
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+A local stand-in for Kiwibank internet banking, serving the sanitised fixture
+pages and generated statement exports, for benchmarking without the real bank.
+
+Usage:
+    python benchmarks/mock_server.py [--port 8080] [--latency 0.05] [--rows-per-day 5]
+"""
+import argparse
+import datetime
+import os
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+EXPORT_FIELD = "ctl00$c$TransactionSearchControl$"
+SESSION_COOKIE = "ASP.NET_SessionId"
+
+
+class MockKiwibankServer(object):
+    """
+    A threaded HTTP server mimicking the login, KeepSafe challenge, account and export pages.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, rows_per_day: int = 5):
+        """
+        Args:
+            host (str): The interface to listen on.
+            port (int): The port to listen on, 0 to pick a free one.
+            latency (float): Seconds to delay every response by.
+            rows_per_day (int): Transactions generated per day of an export, controlling payload size.
+        """
+        self.latency = latency
+        self.rows_per_day = rows_per_day
+        self.sessions = set()
+        self.lock = threading.Lock()
+        self.pages = {}
+        for name in ("login", "challenge", "accounts", "account"):
+            with open(os.path.join(FIXTURES, f"{name}.html"), "rb") as fixture:
+                self.pages[name] = fixture.read()
+
+        handler = type("Handler", (_Handler,), {"server_state": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serves requests from a background thread.
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-kiwibank", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_state = None
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, avoid Nagle/delayed ACK stalls between them
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server_state.latency)
+        path = self.path.split("?")[0]
+
+        if path == "/login/":
+            self._send(200, self.server_state.pages["login"])
+        elif path == "/logout/":
+            with self.server_state.lock:
+                self.server_state.sessions.discard(self._session())
+            self._send(200, b"<html><body>Logged out</body></html>")
+        elif not self._logged_in():
+            self._redirect("/login/")
+        elif path == "/keepsafe/challenge/":
+            self._send(200, self.server_state.pages["challenge"])
+        elif path == "/accounts/":
+            self._send(200, self.server_state.pages["accounts"])
+        elif path.startswith("/accounts/view/"):
+            self._send(200, self.server_state.pages["account"])
+        else:
+            self._send(404, b"<html><body>Not found</body></html>")
+
+    def do_POST(self):
+        time.sleep(self.server_state.latency)
+        path = self.path.split("?")[0]
+        form = dict(parse_qsl(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"), True))
+
+        if path == "/login/":
+            session = secrets.token_hex(12)
+            with self.server_state.lock:
+                self.server_state.sessions.add(session)
+            self._redirect("/keepsafe/challenge/", {"Set-Cookie": f"{SESSION_COOKIE}={session}; Path=/; HttpOnly"})
+        elif not self._logged_in():
+            self._redirect("/login/")
+        elif path == "/keepsafe/challenge/":
+            self._redirect("/accounts/")
+        elif path.startswith("/accounts/view/") and "__RequestVerificationToken" in form:
+            self._export(path, form)
+        else:
+            self._send(400, b"<html><body>Bad request</body></html>")
+
+    def _export(self, path, form):
+        try:
+            date_from = _parse_date(form[EXPORT_FIELD + "DualDateSelector$initialDate$TextBox"])
+            date_to = _parse_date(form[EXPORT_FIELD + "DualDateSelector$finalDate$TextBox"])
+            export_format = form[EXPORT_FIELD + "ExportFormats$List"]
+        except (KeyError, ValueError):
+            self._send(200, self.server_state.pages["account"])
+            return
+
+        rows = _generate_rows(path, date_from, date_to, self.server_state.rows_per_day)
+        if not rows:
+            # The real site redisplays the account page when there is nothing to export
+            self._send(200, self.server_state.pages["account"])
+            return
+
+        body, extension = _render_export(rows, export_format)
+        self._send(200, body, {
+            "Content-Type": "application/octet-stream",
+            "Content-Disposition": f"attachment; filename=export.{extension}",
+        })
+
+    def _session(self):
+        for cookie in self.headers.get("Cookie", "").split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == SESSION_COOKIE:
+                return value
+        return None
+
+    def _logged_in(self):
+        with self.server_state.lock:
+            return self._session() in self.server_state.sessions
+
+    def _redirect(self, location, headers=None):
+        self._send(302, b"", dict(headers or {}, Location=location))
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        headers = dict(headers or {})
+        headers.setdefault("Content-Type", "text/html; charset=utf-8")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _parse_date(value):
+    day, month, year = (int(part) for part in value.split("/"))
+    return datetime.date(year, month, day)
+
+
+def _generate_rows(path, date_from, date_to, rows_per_day):
+    # Seeded by account and day, so overlapping exports return identical transactions
+    rows = []
+    day = date_from
+    while day <= date_to:
+        generator = random.Random(f"{path}:{day.isoformat()}")
+        for _ in range(rows_per_day):
+            amount = generator.randint(-20000, 15000)
+            balance = generator.randint(0, 10000000)
+            rows.append((day, f"POS W/D MERCHANT {generator.randint(0, 99999):05d}", amount, balance))
+        day += datetime.timedelta(days=1)
+    return rows
+
+
+def _render_export(rows, export_format):
+    if export_format in ("PDF-Extended", "PDF-Basic"):
+        generator = random.Random(len(rows))
+        return b"%PDF-1.4\n" + bytes(generator.getrandbits(8) for _ in range(len(rows) * 64)) + b"\n%%EOF\n", "pdf"
+
+    if export_format == "OFX":
+        lines = ["OFXHEADER:100", "<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>"]
+        for index, (day, description, amount, _) in enumerate(rows):
+            lines += [
+                "<STMTTRN>",
+                "<TRNTYPE>" + ("CREDIT" if amount > 0 else "DEBIT"),
+                f"<DTPOSTED>{day:%Y%m%d}",
+                f"<TRNAMT>{amount / 100:.2f}",
+                f"<FITID>{day:%Y%m%d}{index:06d}",
+                f"<NAME>{description}",
+                "</STMTTRN>",
+            ]
+        lines.append("</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>")
+        return "\r\n".join(lines).encode("utf-8"), "ofx"
+
+    if export_format == "QIF":
+        lines = ["!Type:Bank"]
+        for day, description, amount, _ in rows:
+            lines += [f"D{day:%d/%m/%Y}", f"T{amount / 100:.2f}", f"P{description}", "^"]
+        return "\r\n".join(lines).encode("utf-8"), "qif"
+
+    if export_format == "CSV-Basic":
+        lines = ["38-9000-0123456-00,,,,"]
+        for day, description, amount, balance in rows:
+            lines.append(f"{day:%d %b %Y},{description} ;,,{amount / 100:.2f},{balance / 100:.2f}")
+        return "\r\n".join(lines).encode("utf-8"), "csv"
+
+    lines = [
+        "Account number,Date,Memo/Description,Source Code (payment type),TP ref,TP part,TP code,OP ref,"
+        "OP part,OP code,OP name,OP Bank Account Number,Amount (credit),Amount (debit),Amount,Balance"
+    ]
+    for day, description, amount, balance in rows:
+        credit = f"{amount / 100:.2f}" if amount > 0 else ""
+        debit = f"{-amount / 100:.2f}" if amount <= 0 else ""
+        lines.append(
+            f"38-9000-0123456-00,{day:%d-%m-%Y},{description} ;,POS,,,,,,,,,{credit},{debit},"
+            f"{amount / 100:.2f},{balance / 100:.2f}"
+        )
+    return "\r\n".join(lines).encode("utf-8"), "csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay every response by")
+    parser.add_argument("--rows-per-day", type=int, default=5, help="Transactions per day in exports")
+    args = parser.parse_args()
+
+    server = MockKiwibankServer(args.host, args.port, args.latency, args.rows_per_day)
+    print(f"Serving mock Kiwibank on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import calendar
+import datetime
+
+from transactions import CSV_FORMATS, parse_csv
+
+# Months per chunk for the named chunk periods
+PERIOD_MONTHS = {"month": 1, "quarter": 3, "half-year": 6, "year": 12}
+
+
+def split_date_range(date_from: datetime.date, date_to: datetime.date, period="month") -> list:
+    """
+    Splits a date range into consecutive, non-overlapping chunks.
+
+    Args:
+        date_from (datetime.date): The first day of the range.
+        date_to (datetime.date): The last day of the range.
+        period (str | int): "month", "quarter", "half-year" or "year" to split on
+            calendar boundaries, or a number of days per chunk.
+
+    Returns:
+        list: (first day, last day) tuples covering the range in order.
+    """
+    if isinstance(date_from, datetime.datetime):
+        date_from = date_from.date()
+    if isinstance(date_to, datetime.datetime):
+        date_to = date_to.date()
+
+    if isinstance(period, int):
+        if period < 1:
+            raise ValueError("Chunks must be at least one day long.")
+    elif period not in PERIOD_MONTHS:
+        raise ValueError(f"Unsupported chunk period: {period}")
+
+    chunks = []
+    start = date_from
+    while start <= date_to:
+        if isinstance(period, int):
+            end = start + datetime.timedelta(days=period - 1)
+        else:
+            months = PERIOD_MONTHS[period]
+            # Last day of the calendar period containing start
+            month_index = (start.month - 1) // months * months + months - 1
+            year = start.year + month_index // 12
+            month = month_index % 12 + 1
+            end = datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+        end = min(end, date_to)
+        chunks.append((start, end))
+        start = end + datetime.timedelta(days=1)
+
+    return chunks
+
+
+def merge_csv_exports(chunks: list, export_format: str = "CSV-Extended") -> str:
+    """
+    Merges CSV exports of consecutive date ranges into a single export.
+
+    Rows dated outside their own chunk's range are dropped, so transactions on a
+    boundary day are only kept once, and rows are ordered by date (keeping the
+    bank's order within a day). The header of the first non-empty chunk is kept.
+
+    Args:
+        chunks (list): (first day, last day, exported text) tuples; the text may be
+            empty for chunks without statement data.
+        export_format (str): The CSV format the chunks were exported in.
+
+    Returns:
+        str: The merged export.
+    """
+    if export_format not in CSV_FORMATS:
+        raise ValueError(f"Chunked exports can only be merged for {', '.join(CSV_FORMATS)}, not {export_format}.")
+
+    header = None
+    transactions = []
+
+    for date_from, date_to, text in chunks:
+        if not text:
+            continue
+
+        chunk_transactions = parse_csv(text, export_format)
+
+        if header is None:
+            header = []
+            first_row = chunk_transactions[0].raw if chunk_transactions else None
+            for line in text.splitlines():
+                if line == first_row:
+                    break
+                if line.strip():
+                    header.append(line)
+
+        transactions += [t for t in chunk_transactions if date_from <= t.date <= date_to]
+
+    # Stable sort keeps the bank's order of transactions within a day
+    transactions.sort(key=lambda t: t.date)
+
+    return "\n".join((header or []) + [t.raw for t in transactions])
@@ -1,6 +1,9 @@
-from kiwibank_api import KiwibankApi
+from kiwibank_api import KiwibankApi, ExportRequest
+from export_cache import ExportCache
+from session_store import FileSessionStore
 
 import datetime
+import os
 
 class Account:
     def __init__(
@@ -76,23 +79,23 @@ if __name__ == "__main__":
         "PDF-Basic": "pdf"
     }
 
-    kbApi = KiwibankApi()
+    # Reuse the session between runs, encrypted with a key kept in your home directory
+    sessionKey = FileSessionStore.load_or_create_key(os.path.expanduser("~/.kiwibank_session.key"))
+    sessionStore = FileSessionStore("kiwibank_session.bin", key=sessionKey)
 
-    kbApi.login(user, password)
-    kbApi.resolveChallenge(questionsAnswers)
+    # Statements of periods that are over are kept compressed on disk and not downloaded again
+    kbApi = KiwibankApi(export_cache=ExportCache("kiwibank_exports"))
 
-    for account in accounts:
-        exportData = kbApi.exportStatement(
-            account.Id,
-            account.AccountType,
-            account.DateFrom,
-            account.DateTo,
-            account.AmountLow,
-            account.AmountHigh,
-            account.ExportInclude,
-            account.ExportFormat
-        )
+    if not kbApi.restore_session(sessionStore):
+        kbApi.login(user, password)
+        kbApi.resolve_challenge(questionsAnswers)
+        kbApi.save_session(sessionStore)
 
+    # Log in again automatically if the session expires while exporting
+    kbApi.enable_relogin(user, password, questionsAnswers)
+
+    exportRequests = []
+    for account in accounts:
         fileName = "_".join(
             filter(
                 None,
@@ -100,17 +103,42 @@ if __name__ == "__main__":
                     account.Id,
                     str(account.DateFrom.strftime("%Y_%m_%d")),
                     str(account.DateTo.strftime("%Y_%m_%d")),
-                    account.AmountLow,
-                    account.AmountHigh,
+                    str(account.AmountLow),
+                    str(account.AmountHigh),
                     account.ExportInclude,
                     account.ExportFormat,
                 ],
             )
         ).replace(".", "_") + "." + formats[account.ExportFormat]
 
-        fileData = "\n".join(exportData.splitlines())
+        # Exports are streamed straight to the file with line endings normalised
+        exportRequests.append(
+            ExportRequest(
+                account.Id,
+                account.AccountType,
+                account.DateFrom,
+                account.DateTo,
+                account.AmountLow,
+                account.AmountHigh,
+                account.ExportInclude,
+                account.ExportFormat,
+                sink=fileName
+            )
+        )
+
+    results = kbApi.export_statements(exportRequests, max_workers=4)
+
+    # Or discover the accounts instead of listing their ids by hand
+    # for account in kbApi.list_accounts():
+    #     print(account)
+    # results = kbApi.export_all_statements(datetime.datetime(2024, 6, 1), datetime.datetime.today())
 
-        with open(fileName, "w") as exportFile:
-            exportFile.write(fileData)
+    for result in results:
+        if result.ok:
+            print(f"Saved {result.request.sink} ({result.data} bytes)")
+        else:
+            print(f"Export failed for {result.request}: {result.error}")
 
-    kbApi.logout()
\ No newline at end of file
+    # Logging out ends the saved session, only do it when it is no longer needed
+    # kbApi.logout()
+    # sessionStore.clear()
\ No newline at end of file
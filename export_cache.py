@@ -0,0 +1,270 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+# zlib window bits producing and reading the gzip container, so blobs can be inspected with zcat
+GZIP_WBITS = 31
+
+
+class ExportCache(object):
+    """
+    An on-disk cache of raw statement exports, for periods that are over and so can
+    no longer change.
+
+    Exports are stored gzip compressed under the SHA-256 of their content, so
+    identical statements requested with different parameters are stored once. A
+    SQLite index maps each request's key to its blob, and the least recently used
+    entries are evicted once the blobs take more than max_bytes on disk.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+        CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, settle_days: int = 1, level: int = 6):
+        """
+        Args:
+            path (str): The directory holding the cache, created if missing.
+            max_bytes (int): The maximum compressed size of the cached exports.
+            settle_days (int): Days after which a statement period is considered final;
+                periods ending more recently are always fetched from the bank.
+            level (int): The compression level, from 1 (fastest) to 9 (smallest).
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.settle_days = settle_days
+        self.level = level
+        self.logger = logging.getLogger()
+
+        os.makedirs(os.path.join(path, "blobs"), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(
+        account_id: str,
+        account_type: str,
+        date_from,
+        date_to,
+        amount_low,
+        amount_high,
+        export_include: str,
+        export_format: str,
+    ) -> str:
+        """
+        Returns the cache key of an export, as taken by KiwibankApi.export_statement.
+        """
+        fields = [
+            account_id,
+            account_type or "",
+            f"{date_from:%Y-%m-%d}",
+            f"{date_to:%Y-%m-%d}",
+            "" if amount_low in (None, "") else str(amount_low),
+            "" if amount_high in (None, "") else str(amount_high),
+            export_include,
+            export_format,
+        ]
+        return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, date_to, today: datetime.date = None) -> bool:
+        """
+        Returns whether a statement period ending on date_to is over and settled.
+        """
+        if isinstance(date_to, datetime.datetime):
+            date_to = date_to.date()
+        today = today or datetime.date.today()
+        return date_to <= today - datetime.timedelta(days=self.settle_days)
+
+    def get(self, key: str):
+        """
+        Returns a cached export, or None if it is not cached.
+        """
+        chunks = self.open(key)
+        if chunks is None:
+            return None
+        return b"".join(chunks)
+
+    def open(self, key: str, chunk_size: int = 65536):
+        """
+        Returns an iterator over the decompressed chunks of a cached export, or None
+        if it is not cached.
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            try:
+                file = open(self._blob_path(row[0]), "rb")
+            except OSError as e:
+                self.logger.warning(f"Dropping export cache entry with missing blob: {e}")
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+
+            self.connection.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+
+        return self._iter_blob(file, chunk_size)
+
+    def put(self, key: str, content: bytes):
+        """
+        Caches an export.
+        """
+        writer = self.writer(key)
+        writer.write(content)
+        writer.commit()
+
+    def writer(self, key: str):
+        """
+        Returns a writer to cache an export chunk by chunk, as it is downloaded.
+        """
+        return _ExportCacheWriter(self, key)
+
+    def tee(self, key: str, chunks):
+        """
+        Yields the given chunks, caching them once all have been consumed. Nothing is
+        cached if the iteration fails or is abandoned.
+        """
+        writer = self.writer(key)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+                yield chunk
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def size(self) -> int:
+        """
+        Returns the compressed size of the cached exports, in bytes.
+        """
+        with self.lock:
+            return self._size()
+
+    def clear(self):
+        """
+        Removes every cached export.
+        """
+        with self.lock, self.connection:
+            digests = [row[0] for row in self.connection.execute("SELECT DISTINCT digest FROM entries")]
+            self.connection.execute("DELETE FROM entries")
+            for digest in digests:
+                self._remove_blob(digest)
+
+    def close(self):
+        self.connection.close()
+
+    def _commit(self, key: str, digest: str, temp_path: str, size: int):
+        blob_path = self._blob_path(digest)
+        with self.lock, self.connection:
+            if os.path.exists(blob_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(temp_path, blob_path)
+
+            previous = self.connection.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, digest, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, digest, size, time.time()),
+            )
+            if previous is not None and previous[0] != digest:
+                self._remove_unused_blob(previous[0])
+
+            self._evict()
+
+    def _evict(self):
+        # Least recently used first, keeping at least the most recent entry
+        size = self._size()
+        if size <= self.max_bytes:
+            return
+
+        rows = self.connection.execute("SELECT key, digest FROM entries ORDER BY last_used").fetchall()
+        for key, digest in rows[:-1]:
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            if self._remove_unused_blob(digest):
+                size = self._size()
+                if size <= self.max_bytes:
+                    break
+
+    def _size(self) -> int:
+        row = self.connection.execute("SELECT SUM(size) FROM (SELECT DISTINCT digest, size FROM entries)").fetchone()
+        return row[0] or 0
+
+    def _remove_unused_blob(self, digest: str) -> bool:
+        if self.connection.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return False
+        self._remove_blob(digest)
+        return True
+
+    def _remove_blob(self, digest: str):
+        try:
+            os.remove(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.path, "blobs", digest[:2], f"{digest}.gz")
+
+    @staticmethod
+    def _iter_blob(file, chunk_size: int):
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        with file:
+            while True:
+                data = file.read(chunk_size)
+                if not data:
+                    break
+                chunk = decompressor.decompress(data)
+                if chunk:
+                    yield chunk
+
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+
+
+class _ExportCacheWriter(object):
+    """
+    Compresses an export into a temporary file while hashing it, and adds it to the
+    cache under its content hash on commit.
+    """
+
+    def __init__(self, cache: ExportCache, key: str):
+        self.cache = cache
+        self.key = key
+        self.hash = hashlib.sha256()
+        self.compressor = zlib.compressobj(cache.level, zlib.DEFLATED, GZIP_WBITS)
+        fd, self.temp_path = tempfile.mkstemp(dir=os.path.join(cache.path, "blobs"), suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.hash.update(chunk)
+        self.file.write(self.compressor.compress(chunk))
+
+    def commit(self):
+        self.file.write(self.compressor.flush())
+        size = self.file.tell()
+        self.file.close()
+        self.cache._commit(self.key, self.hash.hexdigest(), self.temp_path, size)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,319 @@
+import datetime
+
+from export_stream import BINARY_FORMATS
+from forms import account_url as build_account_url, export_form
+from form_state import EXPORT_FORM_FIELDS, parse_form_state
+
+
+class NoStatementDataError(ValueError):
+    """
+    Raised when the bank has no statement data for the requested export.
+    """
+
+
+class SessionExpiredError(ValueError):
+    """
+    Raised when the bank redirects to the login page and the session cannot be renewed.
+    """
+
+
+class ExportRequest(object):
+    """
+    The parameters of a single statement export, as taken by KiwibankApi.export_statement.
+    """
+
+    def __init__(
+        self,
+        account_id: str,
+        account_type: str,
+        date_from: datetime,
+        date_to: datetime,
+        amount_low: float = None,
+        amount_high: float = None,
+        export_include: str = "DepositsAndWithdrawals",
+        export_format: str = "CSV-Extended",
+        sink=None,
+    ):
+        self.account_id = account_id
+        self.account_type = account_type
+        self.date_from = date_from
+        self.date_to = date_to
+        self.amount_low = amount_low
+        self.amount_high = amount_high
+        self.export_include = export_include
+        self.export_format = export_format
+        self.sink = sink  # Optional path or file to stream the export to
+
+    def args(self):
+        """
+        Returns the positional arguments for KiwibankApi.export_statement.
+        """
+        return (
+            self.account_id,
+            self.account_type,
+            self.date_from,
+            self.date_to,
+            self.amount_low,
+            self.amount_high,
+            self.export_include,
+            self.export_format,
+        )
+
+    def __repr__(self):
+        return (
+            f"ExportRequest(account_id={self.account_id}, account_type={self.account_type}, "
+            f"date_from={self.date_from}, date_to={self.date_to}, export_format={self.export_format})"
+        )
+
+
+class ExportResult(object):
+    """
+    The outcome of one export in a batch: either the exported data or the error raised.
+    """
+
+    def __init__(self, request: ExportRequest, data=None, error: Exception = None):
+        self.request = request
+        self.data = data
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"ExportResult(request={self.request}, ok={self.ok}, error={self.error!r})"
+
+
+class ExportFlow(object):
+    """
+    The decisions of a single statement export, shared by KiwibankApi and
+    AsyncKiwibankApi so that they only differ in how requests are sent and read.
+
+    The flow decides whether the export is served from the export cache, which
+    form state it is posted with, and what follows when the bank answers with a
+    page instead of a file: logging in again once if the session expired,
+    retrying once with fresh state if cached state was rejected, or otherwise
+    giving up with NoStatementDataError.
+    """
+
+    def __init__(
+        self,
+        client,
+        account_id: str,
+        account_type: str,
+        date_from: datetime,
+        date_to: datetime,
+        amount_low: float,
+        amount_high: float,
+        export_include: str,
+        export_format: str,
+    ):
+        """
+        Args:
+            client (KiwibankApi | AsyncKiwibankApi): The client exporting, whose
+                caches, instrumentation and reauthenticator are used.
+            account_id (str): The unique identifier for the account.
+            account_type (str): The type of the account.
+            date_from (datetime): The start date of the statement period.
+            date_to (datetime): The end date of the statement period.
+            amount_low (float): The lower bound of the transaction amount range.
+            amount_high (float): The upper bound of the transaction amount range.
+            export_include (str): The types of transaction details to include in the export.
+            export_format (str): The format of the export.
+        """
+        self.client = client
+        self.account_type = account_type
+        self.date_from = date_from
+        self.date_to = date_to
+        self.amount_low = amount_low
+        self.amount_high = amount_high
+        self.export_include = export_include
+        self.export_format = export_format
+        self.account_url = build_account_url(account_id, account_type)
+        self.tags = {"account": self.account_url}
+
+        # Only periods that are over are cached, as their statements can no longer change
+        self.cache_key = None
+        if client.export_cache is not None and client.export_cache.is_cacheable(date_to):
+            self.cache_key = client.export_cache.key(
+                account_id, account_type, date_from, date_to, amount_low, amount_high, export_include, export_format
+            )
+
+        self.from_cache = False
+        self.relogged = False
+        self.generation = 0
+
+    @property
+    def binary(self) -> bool:
+        return self.export_format in BINARY_FORMATS
+
+    def cached(self, chunks) -> bool:
+        """
+        Records the outcome of opening the export cache under cache_key.
+
+        Args:
+            chunks (iterator): What ExportCache.open returned, None on a miss.
+
+        Returns:
+            bool: Whether the export is served from the cache.
+        """
+        instrumentation = self.client.instrumentation
+        if chunks is None:
+            instrumentation.count("export_cache.misses", phase="export", **self.tags)
+            return False
+
+        self.client.logger.info("Serving statement from the export cache...")
+        instrumentation.count("export_cache.hits", phase="export", **self.tags)
+        return True
+
+    def initial_form_state(self):
+        """
+        Returns the account page's cached form state, or None if the page must be fetched.
+        """
+        form_state = self.client.form_state_cache.get(self.account_url)
+        self.from_cache = form_state is not None
+        return form_state
+
+    def form(self, form_state) -> bytes:
+        """
+        Builds the export payload, noting the reauthenticator generation it is sent under.
+        """
+        self.generation = self.client._auth_generation()
+        with self.client.instrumentation.timer("form_build", phase="export", **self.tags):
+            return export_form(
+                form_state,
+                self.account_url,
+                self.account_type,
+                self.date_from,
+                self.date_to,
+                self.amount_low,
+                self.amount_high,
+                self.export_include,
+                self.export_format,
+            )
+
+    def relogin(self) -> int:
+        """
+        Returns the generation to log in again from after the export was redirected to
+        the login page, raising SessionExpiredError if it already was once.
+
+        The form state must be fetched again afterwards.
+        """
+        if self.relogged:
+            raise SessionExpiredError("Session expired again after logging in.")
+        self.relogged = True
+        self.from_cache = False
+        return self.generation
+
+    def rejected(self, content: bytes):
+        """
+        Handles a page returned instead of a file, keeping its form state for the next export.
+
+        Args:
+            content (bytes): The returned page.
+
+        Returns:
+            FormState: The form state to retry with, or None if the account page must be
+            fetched again first.
+
+        Raises:
+            NoStatementDataError: If the export was posted with fresh form state, so the
+                bank has no statement data for it.
+        """
+        with self.client.instrumentation.timer("parse", phase="export", **self.tags):
+            page_state = parse_form_state(content, EXPORT_FORM_FIELDS)
+        usable = page_state.has_fields(EXPORT_FORM_FIELDS)
+        if usable:
+            self.client.form_state_cache.put(self.account_url, page_state)
+        else:
+            self.client.form_state_cache.invalidate(self.account_url)
+
+        if not self.from_cache:
+            raise NoStatementDataError("No statement data for selected date range.")
+
+        # The cached form state may have been stale, retry once with fresh state
+        self.client.logger.info("Retrying export with refreshed form state...")
+        self.client.instrumentation.count("retry", phase="export", **self.tags)
+        self.from_cache = False
+        return page_state if usable else None
+
+    def result(self, content: bytes):
+        """
+        Returns a whole export as returned by export_statement: bytes for binary formats,
+        otherwise text.
+        """
+        if self.binary:
+            return content
+        return content.decode("utf-8")
+
+
+def account_form_state(client, account_url: str, content: bytes):
+    """
+    Extracts and caches the form state needed to export from an account page.
+
+    Args:
+        client (KiwibankApi | AsyncKiwibankApi): The client that fetched the page.
+        account_url (str): The account page path.
+        content (bytes): The account page.
+
+    Returns:
+        FormState: The form state of the account page.
+    """
+    # Extract necessary hidden form fields for the export request
+    with client.instrumentation.timer("parse", phase="account_page", account=account_url):
+        form_state = parse_form_state(content, EXPORT_FORM_FIELDS)
+    if not form_state.has_fields(EXPORT_FORM_FIELDS):
+        client.logger.error(f"Failed to extract form fields: {form_state}")
+        raise ValueError("Unexpected page structure during export statement retrieval.")
+
+    client.form_state_cache.put(account_url, form_state)
+    return form_state
+
+
+def account_export_requests(
+    accounts: list,
+    date_from: datetime,
+    date_to: datetime,
+    export_include: str,
+    export_format: str,
+    account_types: tuple = None,
+    sink=None,
+) -> list:
+    """
+    Returns an ExportRequest per account, as exported by export_all_statements.
+
+    Args:
+        accounts (list): The AccountInfo of the listed accounts.
+        date_from (datetime): The start date of the statement period.
+        date_to (datetime): The end date of the statement period.
+        export_include (str): The types of transaction details to include in the export.
+        export_format (str): The format of the exports.
+        account_types (tuple): Only export accounts of these types ("" or "credit-card").
+        sink (callable): Called with each AccountInfo to get the path or open file to
+            stream its statement to.
+    """
+    return [
+        ExportRequest(
+            account.account_id,
+            account.account_type,
+            date_from,
+            date_to,
+            export_include=export_include,
+            export_format=export_format,
+            sink=sink(account) if sink is not None else None,
+        )
+        for account in accounts
+        if account_types is None or account.account_type in account_types
+    ]
+
+
+def redirected_to_login(redirected: bool, path: str) -> bool:
+    """
+    Returns whether a response was redirected to the login page, which the bank does
+    once a session has expired.
+
+    Args:
+        redirected (bool): Whether the response followed any redirects.
+        path (str): The path of the final URL.
+    """
+    return redirected and "/login" in path
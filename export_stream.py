@@ -0,0 +1,104 @@
+import codecs
+import io
+import os
+
+# Export formats that are downloaded as binary files and must not be decoded
+BINARY_FORMATS = ("PDF-Extended", "PDF-Basic")
+
+
+def iter_response(response, chunk_size: int = 65536):
+    """
+    Yields the body of a streamed response in chunks, closing the response once done.
+
+    Args:
+        response (requests.Response): A response requested with stream=True.
+        chunk_size (int): The maximum size of each chunk in bytes.
+    """
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+
+class NewlineNormaliser(object):
+    """
+    Decodes byte chunks incrementally and normalises line endings to "\\n".
+
+    A "\\r" at the end of a chunk is held back until the next chunk shows whether
+    it starts a "\\r\\n" pair, so line endings split across chunks are handled.
+    """
+
+    def __init__(self, encoding: str = "utf-8"):
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.pending = ""
+
+    def feed(self, chunk: bytes) -> str:
+        """
+        Returns the normalised text decoded so far from the given chunk.
+        """
+        text = self.pending + self.decoder.decode(chunk)
+        self.pending = ""
+        if text.endswith("\r"):
+            text, self.pending = text[:-1], "\r"
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+    def finish(self) -> str:
+        """
+        Returns any text held back at the end of the input.
+        """
+        text = self.pending + self.decoder.decode(b"", final=True)
+        self.pending = ""
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def iter_normalised_text(chunks, encoding: str = "utf-8"):
+    """
+    Decodes byte chunks incrementally, normalising line endings (see NewlineNormaliser).
+
+    Args:
+        chunks (iterable): The byte chunks to decode.
+        encoding (str): The text encoding of the chunks.
+    """
+    normaliser = NewlineNormaliser(encoding)
+
+    for chunk in chunks:
+        text = normaliser.feed(chunk)
+        if text:
+            yield text
+
+    text = normaliser.finish()
+    if text:
+        yield text
+
+
+def write_to_sink(chunks, sink) -> int:
+    """
+    Writes chunks to a file path or file-like object without holding them all in memory.
+
+    Args:
+        chunks (iterable): The chunks to write, bytes or str.
+        sink (str | os.PathLike | file): A path to create, or an open file to write to.
+            Text chunks are UTF-8 encoded unless the file is opened in text mode.
+
+    Returns:
+        int: The number of bytes (or characters, for text mode files) written.
+    """
+    if isinstance(sink, (str, os.PathLike)):
+        with open(sink, "wb") as file:
+            return write_to_sink(chunks, file)
+
+    text_mode = isinstance(sink, io.TextIOBase)
+    written = 0
+
+    for chunk in chunks:
+        if text_mode and isinstance(chunk, bytes):
+            chunk = chunk.decode("utf-8")
+        elif not text_mode and isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+
+        sink.write(chunk)
+        written += len(chunk)
+
+    return written
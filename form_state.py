@@ -0,0 +1,247 @@
+import threading
+import time
+from html.parser import HTMLParser
+
+# Hidden ASP.NET fields posted back with every form
+FORM_FIELDS = ("__VSTATE", "__EVENTVALIDATION")
+EXPORT_FORM_FIELDS = ("__RequestVerificationToken", "__VSTATE", "__EVENTVALIDATION")
+
+# Pages are fed to the parser in chunks so it can stop as soon as everything is found
+CHUNK_SIZE = 16384
+
+
+class FormState(object):
+    """
+    The form fields (and KeepSafe challenge, if requested) extracted from a page.
+    """
+
+    def __init__(self, fields: dict, question: str = None, required: list = None):
+        self.fields = fields
+        self.question = question
+        self.required = required
+
+    def __getitem__(self, field_id):
+        return self.fields[field_id]
+
+    def has_fields(self, field_ids) -> bool:
+        """
+        Returns whether every one of the given fields was found.
+        """
+        return all(self.fields.get(field_id) is not None for field_id in field_ids)
+
+    def __repr__(self):
+        return f"FormState(fields={sorted(self.fields)}, question={self.question!r}, required={self.required})"
+
+
+class FormStateCache(object):
+    """
+    A thread-safe cache of form state per page, expiring entries after a TTL.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Returns the cached form state for a page, or None if missing or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] >= self.ttl:
+                del self.entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key: str, form_state: FormState):
+        """
+        Caches the form state for a page.
+        """
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), form_state)
+
+    def invalidate(self, key: str = None):
+        """
+        Drops the cached form state for a page, or for every page if no key is given.
+        """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+class _Done(Exception):
+    pass
+
+
+class _FormStateParser(HTMLParser):
+    """
+    A streaming parser that only keeps the values of the requested element ids
+    and, optionally, the divs of the #question and #answer challenge sections.
+    """
+
+    def __init__(self, field_ids, challenge):
+        super().__init__(convert_charrefs=True)
+        self.field_ids = set(field_ids)
+        self.fields = {}
+        self.sections_left = {"question", "answer"} if challenge else set()
+        self.section = None
+        self.section_tag = None
+        self.section_depth = 0
+        self.open_divs = []
+        self.div_count = 0
+        self.question = []
+        self.required = []
+
+    def handle_starttag(self, tag, attrs):
+        element_id = self._record_field(attrs)
+
+        if self.section:
+            self._section_starttag(tag)
+        elif element_id in self.sections_left:
+            self.section = element_id
+            self.section_tag = tag
+            self.section_depth = 1
+            self.open_divs = []
+            self.div_count = 0
+
+        self._check_done()
+
+    def handle_startendtag(self, tag, attrs):
+        # Self-closing tags never open a section or a div
+        self._record_field(attrs)
+
+        if self.section:
+            self._mark_required(self.get_starttag_text())
+
+        self._check_done()
+
+    def handle_endtag(self, tag):
+        if not self.section:
+            return
+
+        if tag == "div" and self.open_divs:
+            self.open_divs.pop()
+        if tag == self.section_tag:
+            self.section_depth -= 1
+
+        if self.section_depth == 0:
+            self.sections_left.discard(self.section)
+            self.section = None
+            self._check_done()
+
+    def handle_data(self, data):
+        if self.section == "question" and 1 in self.open_divs:
+            self.question.append(data)
+        elif self.section == "answer":
+            self._mark_required(data)
+
+    def _record_field(self, attrs):
+        element_id = None
+        for name, value in attrs:
+            if name == "id":
+                element_id = value
+                break
+
+        if element_id in self.field_ids:
+            self.fields[element_id] = dict(attrs).get("value")
+            self.field_ids.discard(element_id)
+
+        return element_id
+
+    def _section_starttag(self, tag):
+        if tag == self.section_tag:
+            self.section_depth += 1
+
+        if tag == "div":
+            index = self.div_count
+            self.div_count += 1
+            self.open_divs.append(index)
+            if self.section == "answer" and index >= 1:
+                self.required.append(False)
+
+        if self.section == "answer":
+            self._mark_required(self.get_starttag_text())
+
+    def _mark_required(self, text):
+        # Mirrors checking for "required" anywhere in the markup of each answer div
+        if self.section == "answer" and "required" in text:
+            for index in self.open_divs:
+                if index >= 1:
+                    self.required[index - 1] = True
+
+    def _check_done(self):
+        if not self.field_ids and not self.sections_left and not self.section:
+            raise _Done()
+
+
+def _find_fields(content: str, field_ids):
+    """
+    Locates each field's tag by searching for its id attribute and parses just that tag.
+
+    Returns None when a field can not be located this way, so the caller can fall
+    back to a full streaming parse.
+    """
+    fields = {}
+    for field_id in field_ids:
+        position = content.find(f'id="{field_id}"')
+        if position < 0:
+            return None
+
+        start = content.rfind("<", 0, position)
+        end = content.find(">", position)
+        if start < 0 or end < 0:
+            return None
+
+        parser = _FormStateParser((field_id,), False)
+        try:
+            parser.feed(content[start:end + 1])
+        except _Done:
+            pass
+
+        if field_id not in parser.fields:
+            return None
+        fields[field_id] = parser.fields[field_id]
+
+    return fields
+
+
+def parse_form_state(content, field_ids=FORM_FIELDS, challenge: bool = False) -> FormState:
+    """
+    Extracts hidden form fields, and optionally the KeepSafe challenge, from a page.
+
+    Args:
+        content (bytes | str): The page content.
+        field_ids (tuple): The ids of the elements whose value attribute is needed.
+        challenge (bool): Whether to extract the security question and required letters.
+
+    Returns:
+        FormState: The extracted state. Missing fields are absent from FormState.fields
+        and a missing challenge leaves question set to None.
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+
+    if not challenge:
+        fields = _find_fields(content, field_ids)
+        if fields is not None:
+            return FormState(fields)
+
+    parser = _FormStateParser(field_ids, challenge)
+    try:
+        for start in range(0, len(content), CHUNK_SIZE):
+            parser.feed(content[start:start + CHUNK_SIZE])
+        parser.close()
+    except _Done:
+        pass
+
+    if not challenge:
+        return FormState(parser.fields)
+
+    return FormState(parser.fields, "".join(parser.question).strip() or None, parser.required)
@@ -0,0 +1,306 @@
+import logging
+from urllib.parse import quote_plus
+
+# Headers to post a pre-encoded form body with
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+def account_url(account_id: str, account_type: str) -> str:
+    """
+    Returns the path of an account's page, which is also where exports are posted.
+
+    Args:
+        account_id (str): The unique identifier for the account.
+        account_type (str): The type of the account ("" or "credit-card").
+    """
+    return "/".join(filter(None, ["/accounts/view", account_type, account_id]))
+
+
+def login_form(form_state, username: str, password: str) -> list:
+    """
+    Builds the login form payload.
+
+    Args:
+        form_state (FormState): The form state of the login page.
+        username (str): The user's login username.
+        password (str): The user's password.
+
+    Returns:
+        list: The (name, value) pairs to post.
+    """
+    view_state = form_state["__VSTATE"]
+    event_validation = form_state["__EVENTVALIDATION"]
+
+    return [
+        ("__LASTFOCUS", ""),
+        ("__EVENTTARGET", "ctl00$c$ProgressFinalSubmit$FinalStepButton"),
+        ("__EVENTARGUMENT", ""),
+        ("__VSTATE", view_state),
+        ("__VIEWSTATE", ""),
+        ("__EVENTVALIDATION", event_validation),
+        ("ctl00$c$IESError", ""),
+        ("ctl00$c$ciam", ""),
+        ("ctl00$c$txtUserName", username),
+        ("ctl00$c$txtPassword", password),
+    ]
+
+
+def solve_challenge(form_state, questions: dict) -> tuple:
+    """
+    Picks the letters of the answer requested by a KeepSafe challenge.
+
+    Args:
+        form_state (FormState): The form state of the challenge page, parsed with challenge=True.
+        questions (dict): A dictionary mapping security questions to their answers.
+
+    Returns:
+        tuple: The first letter, the second letter and the challenge pattern
+        ("O" for each required letter, "X" otherwise).
+    """
+    logger = logging.getLogger()
+
+    # Extract the security question from the page
+    question = form_state.question
+    if question is None:
+        logger.error("Failed to extract security question.")
+        raise ValueError("Unexpected security challenge page structure.")
+
+    logger.info(f"Security Question: {question}")
+
+    # Get the answer to the security question
+    answer = questions.get(question)
+    if not answer:
+        logger.error(f"No answer found for the question: {question}")
+        raise ValueError(f"No answer found for the question: {question}")
+
+    try:
+        # Determine the required letters for the challenge
+        required_inputs = []
+        challenge_pattern = ""
+
+        for index, required in enumerate(form_state.required):
+            if required:
+                required_inputs.append(index)
+                challenge_pattern += "O"  # Required letter
+            else:
+                challenge_pattern += "X"  # Not required
+
+        letter1 = str(answer[required_inputs[0]])
+        letter2 = str(answer[required_inputs[1]])
+    except (AttributeError, IndexError, KeyError) as e:
+        logger.error(f"Error parsing challenge response: {e}")
+        raise ValueError("Unexpected structure in challenge response.")
+
+    return letter1, letter2, challenge_pattern
+
+
+def challenge_form(form_state, letter1: str, letter2: str) -> list:
+    """
+    Builds the KeepSafe challenge form payload.
+
+    Args:
+        form_state (FormState): The form state of the challenge page.
+        letter1 (str): The first requested letter of the answer.
+        letter2 (str): The second requested letter of the answer.
+
+    Returns:
+        list: The (name, value) pairs to post.
+    """
+    view_state = form_state["__VSTATE"]
+    event_validation = form_state["__EVENTVALIDATION"]
+
+    return [
+        ("__EVENTTARGET", "ctl00$c$ChallengeControl$SubmitAnswer$FinalStepButton"),
+        ("__EVENTARGUMENT", ""),
+        ("__VSTATE", view_state),
+        ("__VIEWSTATE", ""),
+        ("__EVENTVALIDATION", event_validation),
+        ("letter1", letter1),
+        ("letter2", letter2),
+    ]
+
+
+# Marks a template field whose value is supplied when the template is rendered
+DYNAMIC = object()
+
+
+class FormTemplate(object):
+    """
+    A form payload whose constant fields are URL encoded once, up front.
+
+    Rendering only encodes the dynamic fields and joins them with the pre-encoded
+    segments between them, producing the same body requests would encode from the
+    equivalent list of (name, value) pairs. Post it with FORM_HEADERS.
+    """
+
+    def __init__(self, fields: list):
+        """
+        Args:
+            fields (list): The (name, value) pairs of the form, in order. Fields
+                whose value is DYNAMIC are filled in by render().
+        """
+        self.fields = list(fields)
+        self.segments = []  # (pre-encoded bytes preceding a dynamic value, field name)
+
+        pending = ""
+        for index, (name, value) in enumerate(self.fields):
+            pending += ("&" if index else "") + quote_plus(name) + "="
+            if value is DYNAMIC:
+                self.segments.append((pending.encode("ascii"), name))
+                pending = ""
+            else:
+                pending += quote_plus(value)
+
+        self.suffix = pending.encode("ascii")
+
+    def render(self, values: dict) -> bytes:
+        """
+        Returns the URL encoded form body.
+
+        Args:
+            values (dict): The value of every dynamic field, by field name.
+        """
+        parts = []
+        for prefix, name in self.segments:
+            parts.append(prefix)
+            parts.append(quote_plus(values[name]).encode("ascii"))
+        parts.append(self.suffix)
+        return b"".join(parts)
+
+
+EXPORT_FIELDS = [
+    ("__RequestVerificationToken", DYNAMIC),
+    ("__EVENTTARGET", "ctl00$c$TransactionSearchControl$ActionButton"),
+    ("__EVENTARGUMENT", ""),
+    ("__LASTFOCUS", ""),
+    ("__VSTATE", DYNAMIC),
+    ("__VIEWSTATE", ""),
+    ("__EVENTVALIDATION", DYNAMIC),
+    ("ctl00$c$TransactionSearchControl$AccountList", DYNAMIC),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$initialDate$TextBox", DYNAMIC),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FromDateRegex_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FromDateTextBoxExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FromDateRegex_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$InitialDateNotFuture_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$InitialDateNotFutureTextBoxExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$InitialDateNotFuture_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FromHistoryLimit_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FromHistoryLimitExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FromHistoryLimit_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$finalDate$TextBox", DYNAMIC),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateRegex_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FinalDateTextBoxExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateRegex_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeValidity_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeValidityExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeValidity_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FutureDate_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FinalDateNotFutureExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$FutureDate_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateHistoryLimit_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateHistoryLimitExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateHistoryLimit_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeLimitValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeLimitValidatorExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeLimitValidator_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$AmountRange$TransactionAmountLowerBoundField", DYNAMIC),
+    ("ctl00$c$TransactionSearchControl$AmountRange$LowerBoundRegex_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$AmountRange$LowerBoundTextFieldExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$AmountRange$LowerBoundRegex_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$AmountRange$TransactionAmountUpperBoundField", DYNAMIC),
+    ("ctl00$c$TransactionSearchControl$AmountRange$UpperBoundRegex_Highlight_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$AmountRange$UpperBoundTextFieldExtender_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$AmountRange$UpperBoundRegex_ShowError_ClientState", "VALID"),
+    ("ctl00$c$TransactionSearchControl$DWGroup", DYNAMIC),
+    ("ctl00$c$TransactionSearchControl$ExportFormats$List", DYNAMIC),
+    ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$TransferFundsAmountTextBox", "0.00"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountMandatoryValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountFormatValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountFormatValidator_ShowError_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountValueValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountValueValidator_ShowError_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$TransferFundsAmountTextBox", "0.00"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountMandatoryValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountFormatValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountFormatValidator_ShowError_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountValueValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountValueValidator_ShowError_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$StartingAmountValidator_ErrorToggle_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$StartingAmountValidator_ErrorHighlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$GoalAmountValidator_ErrorToggle_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$GoalAmountValidator_ErrorHighLight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$SelectedDateControl$TextBox", ""),
+    ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateOverrideNull", ""),
+    ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateRequiredFieldValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateRangeValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateRangeValidator_ShowError_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateIsDateValidator_Highlight_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateIsDateValidator_ShowError_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$SelectedAccountGoalTypeField", "Savings"),
+]
+
+# Only posted for accounts that are not credit cards
+EXPORT_ACCOUNT_FIELDS = [
+    ("ctl00$c$AccountGoal$SaveGoalControl$AccountTitleTextField", ""),
+    ("ctl00$c$AccountGoal$SaveGoalControl$customisedNameValidation_errorToggle_ClientState", "VALID"),
+    ("ctl00$c$AccountGoal$SaveGoalControl$ToggleCssClassExtender1_ClientState", "VALID"),
+]
+
+_export_templates = {}
+
+
+def export_form_template(account_type: str) -> FormTemplate:
+    """
+    Returns the export form template for an account type, compiled on first use.
+
+    Args:
+        account_type (str): The type of the account.
+    """
+    credit_card = account_type == "credit-card"
+    template = _export_templates.get(credit_card)
+    if template is None:
+        template = FormTemplate(EXPORT_FIELDS if credit_card else EXPORT_FIELDS + EXPORT_ACCOUNT_FIELDS)
+        _export_templates[credit_card] = template
+    return template
+
+
+def export_form(
+    form_state,
+    account_url: str,
+    account_type: str,
+    date_from,
+    date_to,
+    amount_low: float,
+    amount_high: float,
+    export_include: str,
+    export_format: str,
+) -> bytes:
+    """
+    Builds the export form payload for an account page.
+
+    Args:
+        form_state (FormState): The form state of the account page.
+        account_url (str): The account page path.
+        account_type (str): The type of the account.
+        date_from (datetime): The start date of the statement period.
+        date_to (datetime): The end date of the statement period.
+        amount_low (float): The lower bound of the transaction amount range.
+        amount_high (float): The upper bound of the transaction amount range.
+        export_include (str): The types of transaction details to include in the export.
+        export_format (str): The format of the export.
+
+    Returns:
+        bytes: The URL encoded body to post with FORM_HEADERS.
+    """
+    return export_form_template(account_type).render({
+        "__RequestVerificationToken": form_state["__RequestVerificationToken"],
+        "__VSTATE": form_state["__VSTATE"],
+        "__EVENTVALIDATION": form_state["__EVENTVALIDATION"],
+        "ctl00$c$TransactionSearchControl$AccountList": account_url,
+        "ctl00$c$TransactionSearchControl$DualDateSelector$initialDate$TextBox": f"{date_from.day}/{date_from.month}/{date_from.year}",
+        "ctl00$c$TransactionSearchControl$DualDateSelector$finalDate$TextBox": f"{date_to.day}/{date_to.month}/{date_to.year}",
+        "ctl00$c$TransactionSearchControl$AmountRange$TransactionAmountLowerBoundField": "" if amount_low is None else str(amount_low),
+        "ctl00$c$TransactionSearchControl$AmountRange$TransactionAmountUpperBoundField": "" if amount_high is None else str(amount_high),
+        "ctl00$c$TransactionSearchControl$DWGroup": export_include,
+        "ctl00$c$TransactionSearchControl$ExportFormats$List": export_format,
+    })
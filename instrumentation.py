@@ -0,0 +1,180 @@
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Event(object):
+    """
+    A single measurement reported by the client.
+
+    Timings are in seconds and counts are plain numbers (e.g. bytes or retries).
+    """
+
+    __slots__ = ("name", "kind", "value", "tags")
+
+    TIMING = "timing"
+    COUNT = "count"
+
+    def __init__(self, name: str, kind: str, value: float, tags: dict):
+        self.name = name
+        self.kind = kind
+        self.value = value
+        self.tags = tags
+
+    def __repr__(self):
+        return f"Event(name={self.name}, kind={self.kind}, value={self.value}, tags={self.tags})"
+
+
+class Instrumentation(object):
+    """
+    Dispatches timings and counts from the client to registered hooks.
+
+    A hook is any callable taking an Event. Hooks run synchronously on the thread
+    that recorded the measurement, and errors raised by hooks are logged and ignored.
+    """
+
+    def __init__(self, hooks: list = None):
+        self.hooks = list(hooks or [])
+        self.logger = logging.getLogger()
+
+    def add_hook(self, hook):
+        """
+        Registers a callable to receive every Event.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """
+        Unregisters a previously added hook.
+        """
+        self.hooks.remove(hook)
+
+    def emit(self, name: str, kind: str, value: float, **tags):
+        """
+        Sends a measurement to every hook.
+        """
+        if not self.hooks:
+            return
+
+        event = Event(name, kind, value, tags)
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception as e:
+                self.logger.warning(f"Instrumentation hook {hook!r} failed: {e!r}")
+
+    def timing(self, name: str, seconds: float, **tags):
+        """
+        Reports a duration in seconds.
+        """
+        self.emit(name, Event.TIMING, seconds, **tags)
+
+    def count(self, name: str, value: float = 1, **tags):
+        """
+        Reports a count, such as a number of bytes or retries.
+        """
+        self.emit(name, Event.COUNT, value, **tags)
+
+    def stream(self, name: str, chunks, **tags):
+        """
+        Passes chunks through, reporting the time taken to consume them and their size.
+        """
+        start = time.perf_counter()
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.timing(name, time.perf_counter() - start, **tags)
+            self.count("http.bytes", size, **tags)
+
+    @contextmanager
+    def timer(self, name: str, **tags):
+        """
+        Times the enclosed block and reports it, even if the block raises.
+
+        Yields:
+            dict: The event tags, which the block may add to.
+        """
+        start = time.perf_counter()
+        try:
+            yield tags
+        finally:
+            self.timing(name, time.perf_counter() - start, **tags)
+
+
+class StatsdExporter(object):
+    """
+    An instrumentation hook sending events to a StatsD server over UDP.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8125, prefix: str = "kiwibank"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, event: Event):
+        name = ".".join(filter(None, [self.prefix, event.name, event.tags.get("phase")]))
+        if event.kind == Event.TIMING:
+            line = f"{name}:{event.value * 1000:.3f}|ms"
+        else:
+            line = f"{name}:{event.value}|c"
+
+        try:
+            self.socket.sendto(line.encode("ascii", errors="replace"), self.address)
+        except OSError:
+            # Metrics are best effort, never fail the client over them
+            pass
+
+    def close(self):
+        self.socket.close()
+
+
+class PrometheusExporter(object):
+    """
+    An instrumentation hook aggregating events into Prometheus counters and summaries,
+    rendered in the text exposition format by render().
+    """
+
+    def __init__(self, prefix: str = "kiwibank"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.timings = {}
+
+    def __call__(self, event: Event):
+        name = f"{self.prefix}_{event.name}".replace(".", "_")
+        labels = tuple(sorted((key, str(value)) for key, value in event.tags.items() if isinstance(value, str)))
+
+        with self.lock:
+            if event.kind == Event.TIMING:
+                total, count = self.timings.get((name, labels), (0.0, 0))
+                self.timings[(name, labels)] = (total + event.value, count + 1)
+            else:
+                self.counts[(name, labels)] = self.counts.get((name, labels), 0) + event.value
+
+    def render(self) -> str:
+        """
+        Returns the aggregated metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counts.items()):
+                lines.append(f"{name}_total{_labels(labels)} {value}")
+            for (name, labels), (total, count) in sorted(self.timings.items()):
+                lines.append(f"{name}_seconds_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_seconds_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
@@ -1,7 +1,30 @@
+import copy
 import requests
 import logging
 import datetime
-from bs4 import BeautifulSoup
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from accounts import parse_accounts
+from chunked_export import merge_csv_exports, split_date_range
+from export_flow import (
+    ExportFlow,
+    ExportRequest,
+    ExportResult,
+    NoStatementDataError,
+    SessionExpiredError,
+    account_export_requests,
+    account_form_state,
+    redirected_to_login,
+)
+from export_stream import BINARY_FORMATS, iter_normalised_text, iter_response, write_to_sink
+from instrumentation import Instrumentation
+from resilience import CircuitOpenError, Reauthenticator, RequestAttempts, RetryPolicy
+from forms import FORM_HEADERS, challenge_form, login_form, solve_challenge
+from form_state import FORM_FIELDS, FormStateCache, parse_form_state
+from transactions import CSV_FORMATS
 
 
 class KiwibankApi(object):
@@ -10,16 +33,50 @@ class KiwibankApi(object):
     """
 
     BASE_URL = "https://www.ib.kiwibank.co.nz"
+    USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:132.0) Gecko/20100101 Firefox/132.0"
 
-    def __init__(self):
+    def __init__(
+        self,
+        form_state_ttl: float = 300,
+        instrumentation: Instrumentation = None,
+        timeout: tuple = (10, 60),
+        retry_policy: RetryPolicy = None,
+        circuit_breaker=None,
+        export_cache=None,
+        throttle=None,
+    ):
+        """
+        Args:
+            form_state_ttl (float): Seconds to reuse an account page's form state for
+                repeated exports, 0 to fetch the page before every export.
+            instrumentation (Instrumentation): Receives request, parsing and form
+                building timings; see instrumentation.py for exporters.
+            timeout (tuple): The connect and read timeouts of every request, in seconds.
+            retry_policy (RetryPolicy): How idempotent requests are retried after
+                connection errors and transient error statuses.
+            circuit_breaker (CircuitBreaker): Pauses requests after repeated failures,
+                by default shared by all clients talking to the same host.
+            export_cache (ExportCache): Serves repeated exports of past periods from
+                disk instead of the bank; see export_cache.py.
+            throttle (callable): Called before every request is sent, blocking until a
+                rate limit allows it; forks share it. See SessionPool.throttle.
+        """
         self.BASE_URL = self.BASE_URL.rstrip("/")
 
         self.session = requests.Session()
-        self.session.headers.update(
-            {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:132.0) Gecko/20100101 Firefox/132.0"}
-        )
+        self.session.headers.update({"User-Agent": self.USER_AGENT})
         self.logger = logging.getLogger()
         self.last_response = None
+        self.form_state_cache = FormStateCache(form_state_ttl)
+        self.instrumentation = instrumentation or Instrumentation()
+        self.keep_alive_stop = None
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker
+        self.reauthenticator = None
+        self.accounts = None
+        self.export_cache = export_cache
+        self.throttle = throttle
 
     def login(self, username: str, password: str):
         """
@@ -31,49 +88,39 @@ class KiwibankApi(object):
         """
         self.logger.info("Attempting login...")
 
+        # Form state and accounts from a previous session are no longer valid
+        self.form_state_cache.invalidate()
+        self.accounts = None
+
         try:
             # Perform GET request to fetch the login page
-            self.last_response = self.session.get(f"{self.BASE_URL}/login/")
+            self.last_response = self._request("GET", f"{self.BASE_URL}/login/", "login_page")
             self.last_response.raise_for_status()
         except requests.RequestException as e:
             self.logger.error(f"Network error: {e}")
             raise
 
-        soup = BeautifulSoup(self.last_response.content, "html.parser")
-        self.logger.debug(soup.prettify())
+        self._log_page()
 
         try:
             # Extract necessary form fields from the login page
-            view_state = soup.find(id="__VSTATE")["value"]
-            event_validation = soup.find(id="__EVENTVALIDATION")["value"]
+            with self.instrumentation.timer("parse", phase="login_page"):
+                form_state = parse_form_state(self.last_response.content, FORM_FIELDS)
+            # Prepare data payload for the login POST request
+            data = login_form(form_state, username, password)
         except (TypeError, KeyError) as e:
             self.logger.error(f"Failed to extract form fields: {e}")
             raise ValueError("Unexpected login page structure.")
 
-        # Prepare data payload for the login POST request
-        data = [
-            ("__LASTFOCUS", ""),
-            ("__EVENTTARGET", "ctl00$c$ProgressFinalSubmit$FinalStepButton"),
-            ("__EVENTARGUMENT", ""),
-            ("__VSTATE", view_state),
-            ("__VIEWSTATE", ""),
-            ("__EVENTVALIDATION", event_validation),
-            ("ctl00$c$IESError", ""),
-            ("ctl00$c$ciam", ""),
-            ("ctl00$c$txtUserName", username),
-            ("ctl00$c$txtPassword", password),
-        ]
-
         try:
             # Send POST request to submit login details
-            self.last_response = self.session.post(f"{self.BASE_URL}/login/", data=data)
+            self.last_response = self._request("POST", f"{self.BASE_URL}/login/", "login", data=data)
             self.last_response.raise_for_status()
         except requests.RequestException as e:
             self.logger.error(f"Login request failed: {e}")
             raise
 
-        soup = BeautifulSoup(self.last_response.content, "html.parser")
-        self.logger.debug(soup.prettify())
+        self._log_page()
 
     def resolve_challenge(self, questions: dict):
         """
@@ -84,41 +131,10 @@ class KiwibankApi(object):
         """
         self.logger.info("Resolving security challenge...")
 
-        soup = BeautifulSoup(self.last_response.content, "html.parser")
-
-        try:
-            # Extract the security question from the page
-            question = soup.find(id="question").find_all("div")[1].string
-        except (AttributeError, IndexError) as e:
-            self.logger.error(f"Failed to extract security question: {e}")
-            raise ValueError("Unexpected security challenge page structure.")
-
-        self.logger.info(f"Security Question: {question}")
+        with self.instrumentation.timer("parse", phase="challenge_page"):
+            form_state = parse_form_state(self.last_response.content, FORM_FIELDS, challenge=True)
 
-        # Get the answer to the security question
-        answer = questions.get(question)
-        if not answer:
-            self.logger.error(f"No answer found for the question: {question}")
-            raise ValueError(f"No answer found for the question: {question}")
-
-        try:
-            # Parse answers and determine the required letters for the challenge
-            answer_inputs = soup.find(id="answer").find_all("div")[1:]
-            required_inputs = []
-            challenge_pattern = ""
-
-            for index, element in enumerate(answer_inputs):
-                if "required" in str(element):
-                    required_inputs.append(index)
-                    challenge_pattern += "O"  # Required letter
-                else:
-                    challenge_pattern += "X"  # Not required
-
-            letter1 = str(answer[required_inputs[0]])
-            letter2 = str(answer[required_inputs[1]])
-        except (AttributeError, IndexError, KeyError) as e:
-            self.logger.error(f"Error parsing challenge response: {e}")
-            raise ValueError("Unexpected structure in challenge response.")
+        letter1, letter2, challenge_pattern = solve_challenge(form_state, questions)
 
         self.logger.info(f"Challenge: {challenge_pattern}")
         self.logger.debug(f"Letter 1: {letter1}")
@@ -126,32 +142,70 @@ class KiwibankApi(object):
 
         try:
             # Extract form fields for submitting the challenge response
-            view_state = soup.find(id="__VSTATE")["value"]
-            event_validation = soup.find(id="__EVENTVALIDATION")["value"]
+            data = challenge_form(form_state, letter1, letter2)
         except (TypeError, KeyError) as e:
             self.logger.error(f"Failed to extract challenge form fields: {e}")
             raise ValueError("Unexpected challenge page structure.")
 
-        data = [
-            ("__EVENTTARGET", "ctl00$c$ChallengeControl$SubmitAnswer$FinalStepButton"),
-            ("__EVENTARGUMENT", ""),
-            ("__VSTATE", view_state),
-            ("__VIEWSTATE", ""),
-            ("__EVENTVALIDATION", event_validation),
-            ("letter1", letter1),
-            ("letter2", letter2),
-        ]
-
         try:
             # Submit the challenge response
-            self.last_response = self.session.post(f"{self.BASE_URL}/keepsafe/challenge/", data=data)
+            self.last_response = self._request("POST", f"{self.BASE_URL}/keepsafe/challenge/", "challenge", data=data)
             self.last_response.raise_for_status()
         except requests.RequestException as e:
             self.logger.error(f"Failed to send challenge response: {e}")
             raise
 
-        soup = BeautifulSoup(self.last_response.content, "html.parser")
-        self.logger.debug(soup.prettify())
+        self._log_page()
+
+    def enable_relogin(self, username: str, password: str, questions: dict):
+        """
+        Keeps the credentials needed to log in again automatically when the session
+        expires in the middle of exporting.
+
+        Args:
+            username (str): The user's login username.
+            password (str): The user's password.
+            questions (dict): A dictionary mapping security questions to their answers.
+        """
+        self.reauthenticator = Reauthenticator(username, password, questions)
+
+    def list_accounts(self, refresh: bool = False) -> list:
+        """
+        Lists the accounts on the accounts overview page, which is only fetched once
+        per session unless refreshed.
+
+        Args:
+            refresh (bool): Whether to fetch the page again, for up to date balances.
+
+        Returns:
+            list: An AccountInfo per account.
+        """
+        if self.accounts is not None and not refresh:
+            return list(self.accounts)
+
+        self.logger.info("Listing accounts...")
+
+        try:
+            generation = self._auth_generation()
+            self.last_response = self._request("GET", f"{self.BASE_URL}/accounts/", "accounts_page")
+            if self._session_expired(self.last_response):
+                self._reauthenticate(generation)
+                self.last_response = self._request("GET", f"{self.BASE_URL}/accounts/", "accounts_page")
+            self.last_response.raise_for_status()
+        except requests.RequestException as e:
+            self.logger.error(f"Failed to fetch accounts: {e}")
+            raise
+
+        self._log_page()
+
+        with self.instrumentation.timer("parse", phase="accounts_page"):
+            accounts = parse_accounts(self.last_response.content)
+        if not accounts:
+            self.logger.error("No accounts found on the accounts page.")
+            raise ValueError("Unexpected accounts page structure.")
+
+        self.accounts = accounts
+        return list(accounts)
 
     def export_statement(
         self,
@@ -163,12 +217,21 @@ class KiwibankApi(object):
         amount_high: float,
         export_include: str,
         export_format: str,
+        stream: bool = False,
+        sink=None,
+        chunk_size: int = 65536,
     ):
         """
         Exports a bank statement for a given account within a specified date range
         and amount range, with the option to include certain transaction details
         and specify the export format.
 
+        The account page's form state is cached, so repeated exports for the same
+        account skip fetching the page. If the bank rejects cached state, the export
+        is retried once with fresh state. If the session has expired, it is logged
+        into again when enable_relogin has been called. Exports of periods that are
+        over are served from the export cache, if the client has one.
+
         Args:
             account_id (str): The unique identifier for the account.
             account_type (str): The type of the account (e.g., "checking", "savings").
@@ -178,132 +241,502 @@ class KiwibankApi(object):
             amount_high (float): The upper bound of the transaction amount range.
             export_include (str): The types of transaction details to include in the export.
             export_format (str): The format of the export (e.g., "CSV", "PDF").
+            stream (bool): Whether to return an iterator of chunks instead of the whole
+                statement. Text chunks are decoded with line endings normalised to "\\n".
+            sink (str | os.PathLike | file): A path or open file to stream the statement
+                to instead of returning it.
+            chunk_size (int): The size in bytes of the chunks read when streaming.
 
         Returns:
-            str: The content of the exported statement if successful, otherwise an empty string.
+            str: The content of the exported statement (bytes for PDF formats), an
+            iterator of chunks if stream is set, or the number of bytes written if a
+            sink is given.
         """
         self.logger.info("Exporting statement...")
 
-        account_url = "/".join(filter(None, ["/accounts/view", account_type, account_id]))
+        flow = ExportFlow(
+            self, account_id, account_type, date_from, date_to, amount_low, amount_high, export_include, export_format
+        )
 
-        self.last_response = self.session.get(self.BASE_URL + account_url)
+        if flow.cache_key is not None:
+            chunks = self.export_cache.open(flow.cache_key, chunk_size)
+            if flow.cached(chunks):
+                return self._export_result(chunks, export_format, stream, sink)
+
+        form_state = flow.initial_form_state()
+        if form_state is None:
+            form_state = self._fetch_export_form_state(flow.account_url)
+
+        while True:
+            data = flow.form(form_state)
+
+            # Send POST request to perform the export
+            try:
+                self.last_response = self._request(
+                    "POST",
+                    self.BASE_URL + flow.account_url,
+                    "export",
+                    tags=flow.tags,
+                    data=data,
+                    headers=FORM_HEADERS,
+                    stream=stream or sink is not None,
+                    # Exports only read statements, so they are safe to send again
+                    idempotent=True,
+                )
+                self.last_response.raise_for_status()
+            except requests.RequestException as e:
+                self.logger.error(f"Failed to export statement: {e}")
+                raise
+
+            if "content-disposition" in self.last_response.headers:
+                break
+
+            if self._session_expired(self.last_response):
+                self.last_response.close()
+                self._reauthenticate(flow.relogin())
+                form_state = self._fetch_export_form_state(flow.account_url)
+                continue
+
+            form_state = flow.rejected(self.last_response.content)
+            if form_state is None:
+                form_state = self._fetch_export_form_state(flow.account_url)
+
+        if not stream and sink is None:
+            if flow.cache_key is not None:
+                self.export_cache.put(flow.cache_key, self.last_response.content)
+            return flow.result(self.last_response.content)
+
+        chunks = self.instrumentation.stream(
+            "http.download", iter_response(self.last_response, chunk_size), phase="export", **flow.tags
+        )
+        if flow.cache_key is not None:
+            chunks = self.export_cache.tee(flow.cache_key, chunks)
 
-        soup = BeautifulSoup(self.last_response.content, "html.parser")
-        self.logger.debug(soup.prettify())
+        return self._export_result(chunks, export_format, stream, sink)
 
-        # Extract necessary hidden form fields for the export request
-        try:
-            request_verification_token = soup.find(id="__RequestVerificationToken")["value"]
-            vstate = soup.find(id="__VSTATE")["value"]
-            event_validation = soup.find(id="__EVENTVALIDATION")["value"]
-        except (TypeError, KeyError) as e:
-            self.logger.error(f"Failed to extract form fields: {e}")
-            raise ValueError("Unexpected page structure during export statement retrieval.")
-
-        # Prepare the data for export request
-        data = [
-            ("__RequestVerificationToken", request_verification_token),
-            ("__EVENTTARGET", "ctl00$c$TransactionSearchControl$ActionButton"),
-            ("__EVENTARGUMENT", ""),
-            ("__LASTFOCUS", ""),
-            ("__VSTATE", vstate),
-            ("__VIEWSTATE", ""),
-            ("__EVENTVALIDATION", event_validation),
-            ("ctl00$c$TransactionSearchControl$AccountList", account_url),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$initialDate$TextBox", "{dt.day}/{dt.month}/{dt.year}".format(dt=date_from)),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FromDateRegex_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FromDateTextBoxExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FromDateRegex_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$InitialDateNotFuture_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$InitialDateNotFutureTextBoxExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$InitialDateNotFuture_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FromHistoryLimit_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FromHistoryLimitExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FromHistoryLimit_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$finalDate$TextBox", "{dt.day}/{dt.month}/{dt.year}".format(dt=date_to)),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateRegex_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FinalDateTextBoxExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateRegex_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeValidity_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeValidityExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeValidity_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FutureDate_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FinalDateNotFutureExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$FutureDate_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateHistoryLimit_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateHistoryLimitExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$ToDateHistoryLimit_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeLimitValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeLimitValidatorExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DualDateSelector$DateRangeLimitValidator_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$AmountRange$TransactionAmountLowerBoundField", "" if amount_low is None else str(amount_low)),
-            ("ctl00$c$TransactionSearchControl$AmountRange$LowerBoundRegex_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$AmountRange$LowerBoundTextFieldExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$AmountRange$LowerBoundRegex_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$AmountRange$TransactionAmountUpperBoundField", "" if amount_high is None else str(amount_high)),
-            ("ctl00$c$TransactionSearchControl$AmountRange$UpperBoundRegex_Highlight_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$AmountRange$UpperBoundTextFieldExtender_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$AmountRange$UpperBoundRegex_ShowError_ClientState", "VALID"),
-            ("ctl00$c$TransactionSearchControl$DWGroup", export_include),
-            ("ctl00$c$TransactionSearchControl$ExportFormats$List", export_format),
-            ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$TransferFundsAmountTextBox", "0.00"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountMandatoryValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountFormatValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountFormatValidator_ShowError_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountValueValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$Starting$AmountControl$AmountValueValidator_ShowError_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$TransferFundsAmountTextBox", "0.00"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountMandatoryValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountFormatValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountFormatValidator_ShowError_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountValueValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$TargetBalance$AmountControl$AmountValueValidator_ShowError_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$StartingAmountValidator_ErrorToggle_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$StartingAmountValidator_ErrorHighlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$GoalAmountValidator_ErrorToggle_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$GoalAmountValidator_ErrorHighLight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$SelectedDateControl$TextBox", ""),
-            ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateOverrideNull", ""),
-            ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateRequiredFieldValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateRangeValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateRangeValidator_ShowError_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateIsDateValidator_Highlight_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$DateControl$DateIsDateValidator_ShowError_ClientState", "VALID"),
-            ("ctl00$c$AccountGoal$SaveGoalControl$SelectedAccountGoalTypeField", "Savings")
-        ]
-
-        # Add additional fields if account type is not credit card
-        if account_type != "credit-card":
-            data += [
-                ("ctl00$c$AccountGoal$SaveGoalControl$AccountTitleTextField", ""),
-                ("ctl00$c$AccountGoal$SaveGoalControl$customisedNameValidation_errorToggle_ClientState", "VALID"),
-                ("ctl00$c$AccountGoal$SaveGoalControl$ToggleCssClassExtender1_ClientState", "VALID")
-            ]
-
-        # Send POST request to perform the export
-        try:
-            self.last_response = self.session.post(self.BASE_URL + account_url, data=data)
-            self.last_response.raise_for_status()
-        except requests.RequestException as e:
-            self.logger.error(f"Failed to export statement: {e}")
-            raise
+    @staticmethod
+    def _export_result(chunks, export_format: str, stream: bool, sink):
+        """
+        Returns an export's raw byte chunks the way export_statement was asked to.
+        """
+        if not stream and sink is None:
+            content = b"".join(chunks)
+            if export_format in BINARY_FORMATS:
+                return content
+            return content.decode("utf-8")
+
+        if export_format not in BINARY_FORMATS:
+            chunks = iter_normalised_text(chunks)
+
+        if sink is None:
+            return chunks
+
+        return write_to_sink(chunks, sink)
+
+    def _fetch_export_form_state(self, account_url: str):
+        """
+        Fetches an account page and caches the form state needed to export from it.
+
+        Args:
+            account_url (str): The account page path.
+
+        Returns:
+            FormState: The form state of the account page.
+        """
+        generation = self._auth_generation()
+        self.last_response = self._request("GET", self.BASE_URL + account_url, "account_page", tags={"account": account_url})
+        if self._session_expired(self.last_response):
+            self._reauthenticate(generation)
+            self.last_response = self._request("GET", self.BASE_URL + account_url, "account_page", tags={"account": account_url})
+
+        self._log_page()
+
+        return account_form_state(self, account_url, self.last_response.content)
+
+    def export_statements(self, export_requests: list, max_workers: int = 4):
+        """
+        Exports several statements concurrently over the current authenticated session.
+
+        Each worker uses its own HTTP session carrying a copy of the login cookies, so
+        exports run in parallel without sharing the last response between threads.
+
+        Args:
+            export_requests (list): The ExportRequest objects to export.
+            max_workers (int): The maximum number of exports in flight at once.
+
+        Returns:
+            list: An ExportResult per request, in the same order as the requests.
+        """
+        self.logger.info(f"Exporting {len(export_requests)} statements with {max_workers} workers...")
+
+        def export(request):
+            client = self.fork()
+            try:
+                return ExportResult(request, data=client.export_statement(*request.args(), sink=request.sink))
+            except NoStatementDataError as e:
+                self.logger.info(f"No statement data for {request}.")
+                return ExportResult(request, error=e)
+            except Exception as e:
+                self.logger.error(f"Export failed for {request}: {e}")
+                return ExportResult(request, error=e)
+            finally:
+                client.session.close()
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            return list(executor.map(export, export_requests))
+
+    def export_all_statements(
+        self,
+        date_from: datetime,
+        date_to: datetime,
+        export_include: str = "DepositsAndWithdrawals",
+        export_format: str = "CSV-Extended",
+        account_types: tuple = None,
+        sink=None,
+        max_workers: int = 4,
+    ):
+        """
+        Exports the statements of every listed account (see list_accounts) concurrently.
+
+        Args:
+            date_from (datetime): The start date of the statement period.
+            date_to (datetime): The end date of the statement period.
+            export_include (str): The types of transaction details to include in the export.
+            export_format (str): The format of the exports.
+            account_types (tuple): Only export accounts of these types ("" or "credit-card").
+            sink (callable): Called with each AccountInfo to get the path or open file to
+                stream its statement to, instead of returning it.
+            max_workers (int): The maximum number of exports in flight at once.
+
+        Returns:
+            list: An ExportResult per account, whose request's account_id identifies it.
+        """
+        export_requests = account_export_requests(
+            self.list_accounts(), date_from, date_to, export_include, export_format, account_types, sink
+        )
+        return self.export_statements(export_requests, max_workers=max_workers)
+
+    def export_statement_chunked(
+        self,
+        account_id: str,
+        account_type: str,
+        date_from: datetime,
+        date_to: datetime,
+        amount_low: float,
+        amount_high: float,
+        export_include: str,
+        export_format: str = "CSV-Extended",
+        period="month",
+        max_workers: int = 4,
+    ):
+        """
+        Exports a long date range as several smaller exports fetched concurrently and
+        merged into one, staying within the bank's date range limits.
+
+        Args:
+            account_id (str): The unique identifier for the account.
+            account_type (str): The type of the account.
+            date_from (datetime): The start date of the statement period.
+            date_to (datetime): The end date of the statement period.
+            amount_low (float): The lower bound of the transaction amount range.
+            amount_high (float): The upper bound of the transaction amount range.
+            export_include (str): The types of transaction details to include in the export.
+            export_format (str): The format of the export, CSV-Extended or CSV-Basic.
+            period (str | int): The chunk size, "month", "quarter", "half-year", "year"
+                or a number of days.
+            max_workers (int): The maximum number of chunks fetched at once.
+
+        Returns:
+            str: The merged statement, ordered by date.
+        """
+        if export_format not in CSV_FORMATS:
+            raise ValueError(f"Chunked exports are only supported for {', '.join(CSV_FORMATS)}.")
+
+        chunks = split_date_range(date_from, date_to, period)
+        self.logger.info(f"Exporting {date_from} to {date_to} in {len(chunks)} chunks...")
+
+        results = self.export_statements(
+            [
+                ExportRequest(account_id, account_type, start, end, amount_low, amount_high, export_include, export_format)
+                for start, end in chunks
+            ],
+            max_workers=max_workers,
+        )
+
+        exports = []
+        for (start, end), result in zip(chunks, results):
+            if isinstance(result.error, NoStatementDataError):
+                exports.append((start, end, ""))
+            elif not result.ok:
+                raise result.error
+            else:
+                exports.append((start, end, result.data))
+
+        if not any(text for _, _, text in exports):
+            raise NoStatementDataError("No statement data for selected date range.")
+
+        return merge_csv_exports(exports, export_format)
+
+    def fork(self):
+        """
+        Creates a client sharing this client's authenticated session cookies.
+
+        The cookie jar itself is shared, so when any of the clients logs in again
+        after the session expired, the others pick up the new session too.
+
+        Returns:
+            KiwibankApi: A new client with its own HTTP session and last response.
+        """
+        client = copy.copy(self)
+        client.session = requests.Session()
+        client.session.headers.update(self.session.headers)
+        client.session.cookies = self.session.cookies
+        client.last_response = None
+        client.keep_alive_stop = None
+        return client
+
+    def export_session_state(self):
+        """
+        Returns the state needed to resume this authenticated session later.
+
+        Returns:
+            dict: The session cookies and headers, and when they were saved.
+        """
+        return {
+            "saved_at": time.time(),
+            "headers": dict(self.session.headers),
+            "cookies": [
+                {
+                    "name": cookie.name,
+                    "value": cookie.value,
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                    "expires": cookie.expires,
+                    "secure": cookie.secure,
+                    "rest": cookie._rest,
+                }
+                for cookie in self.session.cookies
+            ],
+        }
+
+    def import_session_state(self, state: dict):
+        """
+        Resumes a session from state returned by export_session_state.
+
+        Args:
+            state (dict): The saved session state.
+        """
+        self.session.headers.update(state.get("headers", {}))
+        self.session.cookies.clear()
+        for cookie in state.get("cookies", []):
+            self.session.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+        self.form_state_cache.invalidate()
+        self.accounts = None
+
+    def is_session_valid(self):
+        """
+        Checks whether the session is still logged in, without following redirects.
+
+        Network errors and unexpected responses are raised rather than reported as an
+        expired session, so a transient outage is not mistaken for a logout.
+
+        Returns:
+            bool: True if the accounts page is served, False if it redirects to login.
+
+        Raises:
+            requests.RequestException: If the bank could not be reached or answered
+                with anything else.
+            CircuitOpenError: If requests to the bank are paused after repeated failures.
+        """
+        response = self._request("GET", f"{self.BASE_URL}/accounts/", "session_check", allow_redirects=False)
+
+        if response.status_code == 200:
+            return True
+        if response.is_redirect and "/login" in response.headers.get("Location", ""):
+            return False
+
+        response.raise_for_status()
+        raise requests.HTTPError(f"Unexpected response checking the session: {response.status_code}", response=response)
+
+    def save_session(self, store):
+        """
+        Saves the current session to a SessionStore.
+
+        Args:
+            store (SessionStore): Where to persist the session.
+        """
+        store.save(self.export_session_state())
+
+    def restore_session(self, store, max_age: float = 3600):
+        """
+        Restores a saved session if it is recent enough and still logged in.
+
+        The saved session is only discarded when the bank redirects to login; if the
+        check fails for any other reason the error is raised and the store is kept.
 
-        if not "content-disposition" in self.last_response.headers:
-            raise ValueError("No statement data for selected date range.")
-        
-        return self.last_response.content.decode("utf-8")
+        Args:
+            store (SessionStore): Where the session was persisted.
+            max_age (float): Seconds after which a saved session is not even checked.
+
+        Returns:
+            bool: True if the session was restored, False if a full login is needed.
+        """
+        state = store.load()
+        if not state or time.time() - state.get("saved_at", 0) > max_age:
+            self.logger.info("No recent saved session.")
+            return False
+
+        self.import_session_state(state)
+        if not self.is_session_valid():
+            self.logger.info("Saved session has expired.")
+            self.session.cookies.clear()
+            store.clear()
+            return False
+
+        self.logger.info("Restored saved session.")
+        return True
+
+    def start_keep_alive(self, interval: float = 240, store=None):
+        """
+        Periodically pings the bank from a background thread so the session does not time out.
+
+        Args:
+            interval (float): Seconds between pings.
+            store (SessionStore): Optionally re-save the session after each ping.
+        """
+        self.stop_keep_alive()
+        self.keep_alive_stop = stop = threading.Event()
+
+        def keep_alive():
+            while not stop.wait(interval):
+                try:
+                    valid = self.is_session_valid()
+                except (requests.RequestException, CircuitOpenError) as e:
+                    self.logger.warning(f"Keep-alive ping failed, retrying next interval: {e}")
+                    continue
+                if not valid:
+                    self.logger.warning("Session expired, stopping keep-alive.")
+                    return
+                if store is not None:
+                    store.save(self.export_session_state())
+
+        threading.Thread(target=keep_alive, name="kiwibank-keep-alive", daemon=True).start()
+
+    def stop_keep_alive(self):
+        """
+        Stops the keep-alive thread, if running.
+        """
+        if self.keep_alive_stop is not None:
+            self.keep_alive_stop.set()
+            self.keep_alive_stop = None
 
     def logout(self):
         """
         Logs out of the Kiwibank session.
         """
         try:
-            self.session.get(f"{self.BASE_URL}/logout/").raise_for_status()
+            self._request("GET", f"{self.BASE_URL}/logout/", "logout").raise_for_status()
         except requests.RequestException as e:
             self.logger.error(f"Failed to log out: {e}")
 
+    def _request(self, method: str, url: str, phase: str, tags: dict = None, idempotent: bool = None, **kwargs):
+        """
+        Sends an HTTP request on the session, reporting its timings and size.
+
+        Requests time out after the client's connect and read timeouts, and fail
+        fast while the host's circuit breaker is open. Idempotent requests are
+        retried with jittered exponential backoff after connection errors and
+        transient error statuses.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The absolute URL to request.
+            phase (str): The client step the request belongs to, used to tag measurements.
+            tags (dict): Extra tags for the measurements, such as the account.
+            idempotent (bool): Whether the request is safe to send again, by default
+                only for idempotent HTTP methods.
+            **kwargs: Passed on to requests.Session.request.
+
+        Returns:
+            requests.Response: The response.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        attempts = RequestAttempts(self, method, url, phase, tags, idempotent)
+
+        while True:
+            if self.throttle is not None:
+                self.throttle()
+            attempts.before_send()
+
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    raise
+            else:
+                delay = attempts.responded(response.status_code, response.headers)
+                if delay is None:
+                    break
+                response.close()
+
+            time.sleep(delay)
+
+        tags = dict(tags or {}, phase=phase, method=method, status=str(response.status_code))
+
+        # Time to the final response headers, including connecting and any redirects
+        # followed (elapsed only covers one hop); the body is read by then unless
+        # streaming, in which case the download is measured as it is consumed
+        ttfb = sum(hop.elapsed.total_seconds() for hop in response.history) + response.elapsed.total_seconds()
+        self.instrumentation.timing("http.ttfb", ttfb, **tags)
+        if not kwargs.get("stream"):
+            self.instrumentation.timing("http.download", max(time.perf_counter() - start - ttfb, 0.0), **tags)
+            self.instrumentation.count("http.bytes", len(response.content), **tags)
+        self.instrumentation.timing("http.request", time.perf_counter() - start, **tags)
+
+        return response
+
+    @staticmethod
+    def _session_expired(response) -> bool:
+        """
+        Returns whether a response was redirected to the login page.
+        """
+        return redirected_to_login(bool(response.history), urlsplit(response.url).path)
+
+    def _auth_generation(self) -> int:
+        return self.reauthenticator.generation if self.reauthenticator is not None else 0
+
+    def _reauthenticate(self, generation: int):
+        """
+        Logs in again after the session expired, or raises SessionExpiredError if no
+        credentials are kept (see enable_relogin).
+
+        Args:
+            generation (int): The reauthenticator generation read before the failed request.
+        """
+        if self.reauthenticator is None:
+            self.logger.error("Session expired and relogin is not enabled.")
+            raise SessionExpiredError("The session has expired.")
+
+        self.logger.info("Session expired, logging in again...")
+        self.instrumentation.count("relogin")
+        self.reauthenticator.reauthenticate(self, generation)
+
+    def _log_page(self):
+        """
+        Logs the last page received, prettified, when debug logging is enabled.
+        """
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+
+        from bs4 import BeautifulSoup
+
+        self.logger.debug(BeautifulSoup(self.last_response.content, "html.parser").prettify())
+
     def __del__(self):
         """
         Closes the session when the object is destroyed.
         """
+        self.stop_keep_alive()
         self.session.close()
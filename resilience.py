@@ -0,0 +1,306 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Methods that can be safely sent again after a failure
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of sending a request while a host's circuit breaker is open.
+    """
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Circuit open for {host} after repeated failures, retry in {retry_after:.1f}s.")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and when a failed request is sent again, with exponential
+    backoff and full jitter so concurrent clients do not retry in lockstep.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 10,
+        retry_statuses: tuple = (429, 500, 502, 503, 504),
+    ):
+        """
+        Args:
+            attempts (int): The maximum number of times a request is sent, 1 to disable retries.
+            backoff (float): The base delay in seconds, doubled after every attempt.
+            max_backoff (float): The maximum delay in seconds between attempts. Requests
+                the server asks to delay for longer are not retried.
+            retry_statuses (tuple): The HTTP statuses that are retried.
+        """
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+
+    def can_retry(self, attempt: int, retry_after: float = None) -> bool:
+        """
+        Returns whether another attempt may follow the given one, counted from 0.
+
+        Args:
+            attempt (int): The failed attempt, counted from 0.
+            retry_after (float): The delay asked for by the server, if any; a delay
+                longer than max_backoff is honoured by not retrying at all.
+        """
+        if retry_after is not None and retry_after > self.max_backoff:
+            return False
+        return attempt + 1 < self.attempts
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        """
+        Returns the seconds to wait before retrying after the given attempt, never less
+        than the delay asked for by the server.
+
+        Args:
+            attempt (int): The failed attempt, counted from 0.
+            retry_after (float): The delay asked for by the server or circuit breaker, if any.
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker(object):
+    """
+    Stops requests to a host after repeated failures, so a struggling bank is given
+    time to recover instead of being hit by every worker.
+
+    After failure_threshold consecutive failures the circuit opens and requests
+    fail fast with CircuitOpenError for reset_timeout seconds. A single trial
+    request is then let through; its success closes the circuit again, and its
+    failure reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, host: str = "", failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        Args:
+            host (str): The host guarded, used in errors.
+            failure_threshold (int): Consecutive failures after which the circuit opens.
+            reset_timeout (float): Seconds the circuit stays open before a trial request.
+        """
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Raises CircuitOpenError if requests to the host are paused.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+
+            retry_after = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and retry_after <= 0:
+                # Let one trial request through, the rest wait for its outcome
+                self.state = self.HALF_OPEN
+                return
+
+            raise CircuitOpenError(self.host, max(retry_after, 0.0))
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def circuit_breaker_for(host: str) -> CircuitBreaker:
+    """
+    Returns the circuit breaker shared by every client talking to a host.
+    """
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(host)
+        if breaker is None:
+            breaker = _circuit_breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def parse_retry_after(headers) -> float:
+    """
+    Returns the delay in seconds asked for by a Retry-After header, if given in seconds.
+    """
+    try:
+        return float(headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class RequestAttempts(object):
+    """
+    The attempts of a single request, deciding through the client's retry policy and
+    the host's circuit breaker whether it is sent again and after how long.
+
+    Sending and waiting are left to the client, so KiwibankApi and AsyncKiwibankApi
+    share these decisions and only differ in their I/O.
+    """
+
+    def __init__(self, client, method: str, url: str, phase: str, tags: dict = None, idempotent: bool = None):
+        """
+        Args:
+            client (KiwibankApi | AsyncKiwibankApi): The client sending the request.
+            method (str): The HTTP method.
+            url (str): The absolute URL requested.
+            phase (str): The client step the request belongs to, used to tag measurements.
+            tags (dict): Extra tags for the measurements, such as the account.
+            idempotent (bool): Whether the request is safe to send again, by default
+                only for idempotent HTTP methods.
+        """
+        self.method = method
+        self.url = url
+        self.tags = dict(tags or {}, phase=phase, method=method)
+        self.idempotent = method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+        self.retry_policy = client.retry_policy
+        self.breaker = client.circuit_breaker or circuit_breaker_for(urlsplit(url).netloc)
+        self.instrumentation = client.instrumentation
+        self.logger = logging.getLogger()
+        self.attempt = 0
+
+    def before_send(self):
+        """
+        Raises CircuitOpenError if requests to the host are paused.
+        """
+        self.breaker.before_request()
+
+    def failed(self, error: Exception) -> float:
+        """
+        Records an attempt that failed without a response.
+
+        Returns:
+            float: The seconds to wait before sending again, or None to raise the error.
+        """
+        self.breaker.record_failure()
+        self.instrumentation.count("http.errors", **self.tags)
+        if not self.idempotent or not self.retry_policy.can_retry(self.attempt):
+            return None
+
+        self.logger.warning(f"Retrying {self.method} {self.url} after error: {error!r}")
+        return self._next_attempt(None)
+
+    def responded(self, status: int, headers) -> float:
+        """
+        Records an attempt that got a response.
+
+        Returns:
+            float: The seconds to wait before sending again, or None to keep the response.
+        """
+        if status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        if not self.idempotent or status not in self.retry_policy.retry_statuses:
+            return None
+
+        retry_after = parse_retry_after(headers)
+        if not self.retry_policy.can_retry(self.attempt, retry_after):
+            if retry_after is not None and retry_after > self.retry_policy.max_backoff:
+                self.logger.warning(f"Not retrying {self.method} {self.url}, the server asked to wait {retry_after:g}s")
+            return None
+
+        self.logger.warning(f"Retrying {self.method} {self.url} after status {status}")
+        return self._next_attempt(retry_after)
+
+    def _next_attempt(self, retry_after: float) -> float:
+        self.instrumentation.count("http.retries", **self.tags)
+        delay = self.retry_policy.delay(self.attempt, retry_after)
+        self.attempt += 1
+        return delay
+
+
+class Reauthenticator(object):
+    """
+    Logs a client back in when its session expires, keeping the credentials needed
+    to do so. Clients sharing a cookie jar (see KiwibankApi.fork) share one
+    Reauthenticator, so a session that expires under several workers at once is
+    only logged into again once.
+    """
+
+    def __init__(self, username: str, password: str, questions: dict):
+        """
+        Args:
+            username (str): The user's login username.
+            password (str): The user's password.
+            questions (dict): A dictionary mapping security questions to their answers.
+        """
+        self.username = username
+        self.password = password
+        self.questions = questions
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.async_lock = None
+
+    def reauthenticate(self, client, generation: int) -> int:
+        """
+        Logs the client in again, unless another client already did since the given generation.
+
+        Args:
+            client (KiwibankApi): The client whose session expired.
+            generation (int): The generation read before the request that found the session expired.
+
+        Returns:
+            int: The new generation.
+        """
+        with self.lock:
+            if self.generation == generation:
+                client.login(self.username, self.password)
+                client.resolve_challenge(self.questions)
+                self.generation += 1
+            return self.generation
+
+    async def reauthenticate_async(self, client, generation: int) -> int:
+        """
+        Logs an AsyncKiwibankApi in again, as reauthenticate does for KiwibankApi.
+
+        Args:
+            client (AsyncKiwibankApi): The client whose session expired.
+            generation (int): The generation read before the request that found the session expired.
+
+        Returns:
+            int: The new generation.
+        """
+        if self.async_lock is None:
+            self.async_lock = asyncio.Lock()
+
+        async with self.async_lock:
+            if self.generation == generation:
+                await client.login(self.username, self.password)
+                await client.resolve_challenge(self.questions)
+                with self.lock:
+                    self.generation += 1
+            return self.generation
+
+    def __repr__(self):
+        return f"Reauthenticator(username={self.username}, generation={self.generation})"
@@ -0,0 +1,361 @@
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from kiwibank_api import ExportRequest, KiwibankApi
+
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket allowing bursts of up to capacity requests and
+    refilling at rate requests per second.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """
+        Takes a token if one is available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one will be available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class Tenant(object):
+    """
+    The credentials of one bank login managed by a SessionPool.
+    """
+
+    def __init__(self, tenant_id: str, username: str, password: str, questions: dict, session_store=None):
+        """
+        Args:
+            tenant_id (str): The key identifying the tenant in the pool.
+            username (str): The user's login username.
+            password (str): The user's password.
+            questions (dict): A dictionary mapping security questions to their answers.
+            session_store (SessionStore): Optionally persists the tenant's session.
+        """
+        self.tenant_id = tenant_id
+        self.username = username
+        self.password = password
+        self.questions = questions
+        self.session_store = session_store
+
+    def __repr__(self):
+        return f"Tenant(tenant_id={self.tenant_id})"
+
+
+class SessionPool(object):
+    """
+    Owns authenticated KiwibankApi sessions for many tenants in one process.
+
+    Live sessions are reused and evicted (logged out) when idle for longer than
+    idle_ttl, checked by the workers about every second, or least recently used
+    first once more than max_sessions are open.
+    Requests to the bank are rate limited per host and per tenant, and queued
+    export jobs are run round-robin across tenants so one tenant's backlog can
+    not starve the others.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 100,
+        idle_ttl: float = 600,
+        host_rate: float = 10,
+        tenant_rate: float = 1,
+        workers: int = 8,
+        client_factory=KiwibankApi,
+    ):
+        """
+        Args:
+            max_sessions (int): The maximum number of sessions kept open.
+            idle_ttl (float): Seconds after which an unused session is logged out.
+            host_rate (float): Maximum requests per second to the bank across all tenants.
+            tenant_rate (float): Maximum requests per second for any single tenant.
+            workers (int): The number of threads running queued export jobs.
+            client_factory (callable): Creates the client for a new session.
+        """
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.tenant_rate = tenant_rate
+        self.client_factory = client_factory
+        self.logger = logging.getLogger()
+
+        self.tenants = {}
+        self.sessions = collections.OrderedDict()  # tenant_id -> (client, last used), LRU first
+        self.tenant_locks = collections.defaultdict(threading.Lock)
+        self.host_bucket = TokenBucket(host_rate)
+        self.tenant_buckets = {}
+        self.lock = threading.Lock()
+
+        # Pending jobs per tenant, and the order in which tenants are served
+        self.queues = collections.OrderedDict()
+        self.ready = threading.Condition(self.lock)
+        self.closed = False
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"kiwibank-pool-{index}", daemon=True)
+            for index in range(max(1, workers))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def add_tenant(self, tenant: Tenant):
+        """
+        Registers a tenant, replacing any tenant with the same id.
+        """
+        with self.lock:
+            self.tenants[tenant.tenant_id] = tenant
+            self.tenant_buckets.setdefault(tenant.tenant_id, TokenBucket(self.tenant_rate))
+
+    def remove_tenant(self, tenant_id: str):
+        """
+        Unregisters a tenant and logs out its session, if open.
+        """
+        with self.lock:
+            self.tenants.pop(tenant_id, None)
+            self.tenant_buckets.pop(tenant_id, None)
+            entry = self.sessions.pop(tenant_id, None)
+
+        if entry is not None:
+            self._close(tenant_id, entry[0])
+
+    def throttle(self, tenant_id: str):
+        """
+        Blocks until both the host and the tenant's rate limits allow another request.
+        """
+        while True:
+            with self.lock:
+                tenant_bucket = self.tenant_buckets.get(tenant_id)
+            wait = tenant_bucket.try_acquire() if tenant_bucket else 0.0
+            if wait:
+                time.sleep(wait)
+                continue
+
+            wait = self.host_bucket.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def session(self, tenant_id: str) -> KiwibankApi:
+        """
+        Returns a logged in client for a tenant, reusing a live session if there is one.
+
+        The client must only be used by one thread at a time; use run() or submit()
+        to serialise work on a tenant's session.
+        """
+        self.evict_idle()
+
+        with self.lock:
+            entry = self.sessions.get(tenant_id)
+            if entry is not None:
+                self.sessions[tenant_id] = (entry[0], time.monotonic())
+                self.sessions.move_to_end(tenant_id)
+                return entry[0]
+
+            tenant = self.tenants.get(tenant_id)
+            if tenant is None:
+                raise KeyError(f"Unknown tenant: {tenant_id}")
+
+        client = self._open(tenant)
+
+        with self.lock:
+            self.sessions[tenant_id] = (client, time.monotonic())
+            self.sessions.move_to_end(tenant_id)
+
+        self.evict_excess(keep=tenant_id)
+        return client
+
+    def run(self, tenant_id: str, job):
+        """
+        Runs a job with the tenant's client, holding the tenant's session exclusively.
+
+        Args:
+            tenant_id (str): The tenant to run the job for.
+            job (callable): Called with the tenant's KiwibankApi; its result is returned.
+        """
+        try:
+            with self.tenant_locks[tenant_id]:
+                return job(self.session(tenant_id))
+        finally:
+            self.evict_excess()
+
+    def submit(self, tenant_id: str, job) -> Future:
+        """
+        Queues a job for a tenant, to be run by the pool's workers.
+
+        Args:
+            tenant_id (str): The tenant to run the job for.
+            job (callable): Called with the tenant's KiwibankApi.
+
+        Returns:
+            Future: Resolves to the job's result, or its exception.
+        """
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The session pool is closed.")
+            if tenant_id not in self.tenants:
+                raise KeyError(f"Unknown tenant: {tenant_id}")
+            self.queues.setdefault(tenant_id, collections.deque()).append((job, future))
+            self.ready.notify()
+        return future
+
+    def submit_export(self, tenant_id: str, request: ExportRequest) -> Future:
+        """
+        Queues a statement export for a tenant.
+
+        Returns:
+            Future: Resolves to the value returned by KiwibankApi.export_statement.
+        """
+        return self.submit(
+            tenant_id,
+            lambda client: client.export_statement(*request.args(), sink=request.sink),
+        )
+
+    def evict_idle(self):
+        """
+        Logs out sessions that have been idle for longer than the idle TTL.
+        """
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            for tenant_id, (client, last_used) in list(self.sessions.items()):
+                if now - last_used < self.idle_ttl:
+                    # Entries are in LRU order, so the rest were used more recently
+                    break
+                if self.tenant_locks[tenant_id].locked():
+                    continue
+                evicted.append((tenant_id, client))
+                del self.sessions[tenant_id]
+
+        for tenant_id, client in evicted:
+            self._close(tenant_id, client)
+
+    def evict_excess(self, keep: str = None):
+        """
+        Logs out the least recently used sessions while more than max_sessions are open.
+
+        Sessions in use are skipped, so the pool may briefly exceed max_sessions.
+        """
+        evicted = []
+        with self.lock:
+            for tenant_id in list(self.sessions):
+                if len(self.sessions) <= self.max_sessions:
+                    break
+                if tenant_id == keep or self.tenant_locks[tenant_id].locked():
+                    continue
+                evicted.append((tenant_id, self.sessions.pop(tenant_id)[0]))
+
+        for tenant_id, client in evicted:
+            self._close(tenant_id, client)
+
+    def close(self):
+        """
+        Stops the workers, failing any queued jobs, and logs out every session.
+        """
+        with self.lock:
+            self.closed = True
+            pending = [future for queue in self.queues.values() for _, future in queue]
+            self.queues.clear()
+            self.ready.notify_all()
+            sessions = list(self.sessions.items())
+            self.sessions.clear()
+
+        for future in pending:
+            future.set_exception(RuntimeError("The session pool was closed."))
+        for thread in self.threads:
+            thread.join()
+        for tenant_id, (client, _) in sessions:
+            self._close(tenant_id, client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next_job(self):
+        """
+        Takes the next job round-robin across tenants whose session is not busy,
+        waiting up to a second for one.
+
+        Returns:
+            tuple: The tenant id and the job, or None if there is none yet.
+        """
+        with self.lock:
+            for tenant_id in list(self.queues):
+                if self.tenant_locks[tenant_id].locked():
+                    continue
+
+                queue = self.queues.pop(tenant_id)
+                job = queue.popleft()
+                if queue:
+                    # Re-queue at the back so other tenants are served first
+                    self.queues[tenant_id] = queue
+                return tenant_id, job
+
+            if not self.closed:
+                self.ready.wait(timeout=1)
+        return None
+
+    def _worker(self):
+        while not self.closed:
+            task = self._next_job()
+            if task is None:
+                # Idle sessions are logged out even when no new work arrives
+                self.evict_idle()
+                continue
+
+            tenant_id, (job, future) = task
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(self.run(tenant_id, job))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.ready.notify_all()
+
+    def _open(self, tenant: Tenant) -> KiwibankApi:
+        client = self.client_factory()
+
+        # Every request the client and its forks send waits for the rate limits first
+        client.throttle = lambda: self.throttle(tenant.tenant_id)
+        client.enable_relogin(tenant.username, tenant.password, tenant.questions)
+
+        if tenant.session_store is not None and client.restore_session(tenant.session_store):
+            return client
+
+        self.logger.info(f"Logging in {tenant}...")
+        client.login(tenant.username, tenant.password)
+        client.resolve_challenge(tenant.questions)
+        if tenant.session_store is not None:
+            client.save_session(tenant.session_store)
+        return client
+
+    def _close(self, tenant_id: str, client: KiwibankApi):
+        self.logger.info(f"Closing session of tenant {tenant_id}...")
+        tenant = self.tenants.get(tenant_id)
+        if tenant is None or tenant.session_store is None:
+            # Persisted sessions are left open for the next process to resume
+            client.logout()
+        client.session.close()
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # Optional dependency, only needed for encrypted stores
+    Fernet = None
+    InvalidToken = ValueError
+
+
+class SessionStore(object):
+    """
+    Persists the state of an authenticated session between runs.
+
+    Subclasses implement load, save and clear; the state is a JSON-serialisable dict
+    as produced by KiwibankApi.export_session_state.
+    """
+
+    def load(self):
+        """
+        Returns the saved session state, or None if there is none.
+        """
+        raise NotImplementedError
+
+    def save(self, state: dict):
+        """
+        Saves the session state, replacing any previous state.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Removes any saved session state.
+        """
+        raise NotImplementedError
+
+
+class FileSessionStore(SessionStore):
+    """
+    Stores session state in a file readable only by the current user, encrypted
+    with Fernet (requires the cryptography package) unless explicitly disabled.
+    """
+
+    def __init__(self, path: str, key: bytes = None, encrypt: bool = True):
+        """
+        Args:
+            path (str): The file to store the session in.
+            key (bytes): The Fernet key (see generate_key and load_or_create_key) to
+                encrypt the file with.
+            encrypt (bool): Whether to encrypt the file. Storing live session cookies
+                as plain JSON must be asked for explicitly with encrypt=False.
+        """
+        if encrypt:
+            if key is None:
+                raise ValueError("A key is required to encrypt the session file, or pass encrypt=False.")
+            if Fernet is None:
+                raise ImportError("Encrypted session stores require the cryptography package.")
+        elif key is not None:
+            raise ValueError("A key was given but encryption is disabled.")
+
+        self.path = path
+        self.fernet = Fernet(key) if encrypt else None
+        self.logger = logging.getLogger()
+
+    @staticmethod
+    def generate_key() -> bytes:
+        """
+        Generates a new random key for encrypting session files.
+        """
+        if Fernet is None:
+            raise ImportError("Encrypted session stores require the cryptography package.")
+        return Fernet.generate_key()
+
+    @staticmethod
+    def load_or_create_key(path: str) -> bytes:
+        """
+        Reads the key stored in a file, generating it and writing it readable only by
+        the current user on first use. Keep it apart from the session file.
+        """
+        try:
+            with open(path, "rb") as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            pass
+
+        key = FileSessionStore.generate_key()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            file.write(key)
+        return key
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            if self.fernet is not None:
+                data = self.fernet.decrypt(data)
+            return json.loads(data.decode("utf-8"))
+        except (ValueError, InvalidToken) as e:
+            self.logger.warning(f"Ignoring unreadable session file {self.path}: {e!r}")
+            return None
+
+    def save(self, state: dict):
+        data = json.dumps(state).encode("utf-8")
+        if self.fernet is not None:
+            data = self.fernet.encrypt(data)
+
+        # Write to a private temporary file first so a crash never leaves a partial session
+        temp_path = f"{self.path}.tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
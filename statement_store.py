@@ -0,0 +1,246 @@
+import datetime
+import logging
+import sqlite3
+import threading
+
+from chunked_export import split_date_range
+from kiwibank_api import KiwibankApi, NoStatementDataError
+from transactions import PARSEABLE_FORMATS, iter_transactions, parse_date
+
+
+class StatementStore(object):
+    """
+    A local SQLite store of parsed transactions and per-account sync progress.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS transactions (
+            account_id TEXT NOT NULL,
+            account_type TEXT NOT NULL,
+            posted TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            description TEXT,
+            amount INTEGER,
+            balance INTEGER,
+            raw TEXT NOT NULL,
+            PRIMARY KEY (account_id, account_type, posted, seq)
+        );
+        CREATE TABLE IF NOT EXISTS sync_state (
+            account_id TEXT NOT NULL,
+            account_type TEXT NOT NULL,
+            synced_to TEXT NOT NULL,
+            PRIMARY KEY (account_id, account_type)
+        );
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+        self.lock = threading.Lock()
+
+    def get_synced_to(self, account_id: str, account_type: str):
+        """
+        Returns the last date synced for an account.
+
+        Args:
+            account_id (str): The unique identifier for the account.
+            account_type (str): The type of the account.
+
+        Returns:
+            datetime.date: The high-water mark, or None if the account was never synced.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT synced_to FROM sync_state WHERE account_id = ? AND account_type = ?",
+                (account_id, account_type or ""),
+            ).fetchone()
+
+        return datetime.date.fromisoformat(row[0]) if row else None
+
+    def merge(self, account_id: str, account_type: str, date_from: datetime.date, date_to: datetime.date, transactions: list):
+        """
+        Merges the transactions of a fetched window into the store.
+
+        The fetched window is complete for every day it covers, so any stored
+        transactions within it are replaced, which de-duplicates the overlap with
+        the previous sync.
+
+        Args:
+            account_id (str): The unique identifier for the account.
+            account_type (str): The type of the account.
+            date_from (datetime.date): The first day of the fetched window.
+            date_to (datetime.date): The last day of the fetched window.
+            transactions (list): The transactions parsed from the window.
+
+        Returns:
+            int: The number of transactions that were not already stored.
+        """
+        account_type = account_type or ""
+        key = (account_id, account_type, date_from.isoformat(), date_to.isoformat())
+
+        with self.lock, self.connection:
+            previous = self.connection.execute(
+                "SELECT COUNT(*) FROM transactions WHERE account_id = ? AND account_type = ? AND posted BETWEEN ? AND ?",
+                key,
+            ).fetchone()[0]
+
+            self.connection.execute(
+                "DELETE FROM transactions WHERE account_id = ? AND account_type = ? AND posted BETWEEN ? AND ?",
+                key,
+            )
+
+            rows = []
+            sequence = {}
+            for transaction in transactions:
+                posted = transaction.date.isoformat()
+                sequence[posted] = sequence.get(posted, -1) + 1
+                rows.append(
+                    (
+                        account_id,
+                        account_type,
+                        posted,
+                        sequence[posted],
+                        transaction.description,
+                        transaction.amount,
+                        transaction.balance,
+                        transaction.raw,
+                    )
+                )
+
+            self.connection.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute(
+                "INSERT INTO sync_state VALUES (?, ?, ?) ON CONFLICT (account_id, account_type) "
+                "DO UPDATE SET synced_to = MAX(synced_to, excluded.synced_to)",
+                (account_id, account_type, date_to.isoformat()),
+            )
+
+        return max(len(rows) - previous, 0)
+
+    def transactions(self, account_id: str, account_type: str, date_from: datetime.date = None, date_to: datetime.date = None):
+        """
+        Returns the stored transactions of an account, oldest first.
+
+        Args:
+            account_id (str): The unique identifier for the account.
+            account_type (str): The type of the account.
+            date_from (datetime.date): The first day to include, or None for no lower bound.
+            date_to (datetime.date): The last day to include, or None for no upper bound.
+
+        Returns:
+            list: Tuples of (date, description, amount, balance, raw).
+        """
+        query = "SELECT posted, description, amount, balance, raw FROM transactions WHERE account_id = ? AND account_type = ?"
+        params = [account_id, account_type or ""]
+        if date_from:
+            query += " AND posted >= ?"
+            params.append(date_from.isoformat())
+        if date_to:
+            query += " AND posted <= ?"
+            params.append(date_to.isoformat())
+        query += " ORDER BY posted, seq"
+
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+
+        return [(datetime.date.fromisoformat(row[0]),) + tuple(row[1:]) for row in rows]
+
+    def close(self):
+        """
+        Closes the underlying database connection.
+        """
+        self.connection.close()
+
+
+class StatementSync(object):
+    """
+    Incrementally syncs statements into a StatementStore, only fetching the
+    days after each account's high-water mark (plus a small overlap).
+
+    Long windows are fetched in windows of at most max_window (see split_date_range),
+    as the bank rejects exports spanning too long a period. Windows are fetched
+    oldest first, and a sync stops at the first window the bank has no data for,
+    so the high-water mark never passes a window that was not stored.
+    """
+
+    def __init__(
+        self,
+        api: KiwibankApi,
+        store: StatementStore,
+        overlap_days: int = 3,
+        export_format: str = "CSV-Extended",
+        max_window="quarter",
+    ):
+        if export_format not in PARSEABLE_FORMATS:
+            raise ValueError(f"Unsupported export format: {export_format}")
+
+        self.api = api
+        self.store = store
+        self.overlap = datetime.timedelta(days=overlap_days)
+        self.export_format = export_format
+        self.max_window = max_window
+        self.logger = logging.getLogger()
+
+    def sync(self, account_id: str, account_type: str, date_from: datetime.date, date_to: datetime.date = None):
+        """
+        Fetches and stores the transactions of an account that are not already synced.
+
+        Args:
+            account_id (str): The unique identifier for the account.
+            account_type (str): The type of the account (e.g., "" or "credit-card").
+            date_from (datetime.date): The start of the history to keep in the store.
+            date_to (datetime.date): The end of the window to sync, defaults to today.
+
+        Returns:
+            int: The number of new transactions stored.
+        """
+        date_from = _as_date(date_from)
+        date_to = _as_date(date_to or datetime.date.today())
+
+        synced_to = self.store.get_synced_to(account_id, account_type)
+        if synced_to:
+            date_from = max(date_from, synced_to - self.overlap)
+
+        if date_from > date_to:
+            self.logger.info(f"Account {account_id} is already synced to {synced_to}.")
+            return 0
+
+        self.logger.info(f"Syncing account {account_id} from {date_from} to {date_to}...")
+
+        added = 0
+        for window_from, window_to in split_date_range(date_from, date_to, self.max_window):
+            try:
+                chunks = self.api.export_statement(
+                    account_id,
+                    account_type,
+                    window_from,
+                    window_to,
+                    None,
+                    None,
+                    "DepositsAndWithdrawals",
+                    self.export_format,
+                    stream=True,
+                )
+                transactions = list(iter_transactions(chunks, self.export_format))
+            except NoStatementDataError:
+                # The bank answers with a page both when there are no transactions and
+                # when it rejects the window. Merging a later window would move the
+                # high-water mark past this one, so stop here and fetch it again next time.
+                self.logger.warning(
+                    f"No statement data for account {account_id} from {window_from} to {window_to}, "
+                    f"stopping the sync at {window_from}."
+                )
+                break
+
+            added += self.store.merge(account_id, account_type, window_from, window_to, transactions)
+
+        self.logger.info(f"Stored {added} new transactions for account {account_id}.")
+
+        return added
+
+
+def _as_date(value) -> datetime.date:
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, str):
+        return parse_date(value)
+    return value